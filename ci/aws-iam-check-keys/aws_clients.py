@@ -0,0 +1,50 @@
+import threading
+
+import botocore.session
+from botocore.config import Config
+
+
+class ClientPool:
+    """
+    Hands out AWS clients that all come from one botocore session, so the service
+    models and endpoint data are only loaded from disk once per run instead of once
+    per client. Clients are kept per service, region and access key, and are safe to
+    share between threads. Calls time out after connect_timeout and read_timeout
+    seconds, so a scan past its deadline is never stuck on a call for long.
+    """
+
+    def __init__(
+        self,
+        max_pool_connections: int = 10,
+        connect_timeout: float = 10,
+        read_timeout: float = 30,
+    ):
+        self._session = botocore.session.get_session()
+        self._config = Config(
+            max_pool_connections=max_pool_connections,
+            tcp_keepalive=True,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+        )
+        self._clients = {}
+        # botocore sessions aren't thread safe, so clients are created one at a time
+        self._lock = threading.Lock()
+
+    def client(
+        self,
+        service_name: str,
+        region_name: str,
+        aws_access_key_id: str,
+        aws_secret_access_key: str,
+    ):
+        key = (service_name, region_name, aws_access_key_id)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = self._session.create_client(
+                    service_name,
+                    region_name=region_name,
+                    aws_access_key_id=aws_access_key_id,
+                    aws_secret_access_key=aws_secret_access_key,
+                    config=self._config,
+                )
+            return self._clients[key]
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+Benchmark for find_stale_keys against synthetic inputs. Generates credential reports,
+terraform state and user yaml files of the requested sizes, stubs IAM with botocore's
+Stubber and points the pushgateway at a local HTTP sink, then reports how long each
+stage takes and its peak memory.
+
+    python benchmarks/bench_find_stale_keys.py --users 1000 10000 100000
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import patch
+
+import yaml
+from botocore.stub import Stubber
+from environs import Env
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import find_stale_keys  # noqa: E402
+from credential_report import iter_report_rows  # noqa: E402
+from user_index import UserIndex  # noqa: E402
+
+HERE = Path(__file__).resolve().parent.parent
+REPORT_COLUMNS = [
+    "user", "arn", "user_creation_time", "password_enabled", "password_last_used",
+    "password_last_changed", "password_next_rotation", "mfa_active",
+    "access_key_1_active", "access_key_1_last_rotated", "access_key_1_last_used_date",
+    "access_key_1_last_used_region", "access_key_1_last_used_service",
+    "access_key_2_active", "access_key_2_last_rotated", "access_key_2_last_used_date",
+    "access_key_2_last_used_region", "access_key_2_last_used_service",
+    "cert_1_active", "cert_1_last_rotated", "cert_2_active", "cert_2_last_rotated",
+]
+
+
+class PushgatewaySink(BaseHTTPRequestHandler):
+    """
+    Accepts pushes like a pushgateway would and counts them
+    """
+    requests = 0
+    bytes = 0
+    lock = threading.Lock()
+
+    def _accept(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with PushgatewaySink.lock:
+            PushgatewaySink.requests += 1
+            PushgatewaySink.bytes += len(body)
+        self.send_response(200)
+        self.end_headers()
+
+    do_PUT = do_POST = do_DELETE = _accept
+
+    def log_message(self, format, *args):
+        pass
+
+
+def user_names(count: int) -> list[str]:
+    prefixes = ["cg-s3-", "cg-ecr-", "cg-cdn-", "cg-rds-", "ops-"]
+    return [f"{prefixes[n % len(prefixes)]}{n:08x}-user" for n in range(count)]
+
+
+def credential_report(names: list[str]) -> bytes:
+    rotated = datetime.now(timezone.utc) - timedelta(days=1)
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(REPORT_COLUMNS)
+    for name in names:
+        row = dict.fromkeys(REPORT_COLUMNS, "N/A")
+        row["user"] = name
+        row["arn"] = f"arn:aws:iam::123456789012:user/{name}"
+        row["access_key_1_active"] = "true"
+        row["access_key_1_last_rotated"] = (
+            rotated - timedelta(days=random.randrange(400))
+        ).isoformat(timespec="seconds")
+        writer.writerow(row.values())
+    return out.getvalue().encode("utf-8")
+
+
+def write_inputs(directory: Path, names: list[str], accounts: int):
+    # Terraform state with a username output for a tenth of the users, the stalekey
+    # profiles, and plenty of other outputs that have to be skipped over
+    tf_outputs = {f"{name}_username": name for name in names[::10]}
+    tf_outputs.update({f"output_{n}": {"value": list(range(10))} for n in range(len(names))})
+    state = {"terraform_version": "1.5.0", "terraform_outputs": tf_outputs}
+    (directory / "tf-state.yml").write_text(yaml.safe_dump(state))
+
+    profiles = {}
+    for account in range(accounts):
+        profiles[f"account{account}_stalekey_id_stalekey"] = f"AKIA{account:016d}"
+        profiles[f"account{account}_stalekey_secret_stalekey"] = "secret"
+    state = {"terraform_outputs": dict(tf_outputs, **profiles)}
+    (directory / "profiles.yml").write_text(yaml.safe_dump(state))
+
+    sso = {"users": {f"ops-{n:08x}-user": {"aws_groups": ["Operators"]} for n in range(0, len(names), 50)}}
+    (directory / "users.yaml").write_text(yaml.safe_dump(sso))
+
+    other = [
+        {"user": prefix, "account_type": "Customer", "is_wildcard": True,
+         "warn": 300, "violation": 360, "alert": False}
+        for prefix in ["cg-s3-", "cg-cdn-"]
+    ]
+    (directory / "other_iam_users.yml").write_text(yaml.safe_dump(other))
+
+
+def measure(results: dict, stage: str, function, *args, **kwargs):
+    # The job's own progress output is thrown away so it doesn't flood the results
+    tracemalloc.start()
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        value = function(*args, **kwargs)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results[stage] = (elapsed, peak)
+    return value
+
+
+def stubbed_clients(report: bytes):
+    # Every IAM client hands back the synthetic report, already generated
+    pool = find_stale_keys.ClientPool()
+    stubbers = []
+
+    def client(service_name, region_name, aws_access_key_id, aws_secret_access_key):
+        iam = pool.client(service_name, region_name, aws_access_key_id, aws_secret_access_key)
+        stubber = Stubber(iam)
+        stubber.add_response("get_credential_report", {
+            "Content": report,
+            "ReportFormat": "text/csv",
+            "GeneratedTime": datetime.now(timezone.utc),
+        })
+        stubber.activate()
+        stubbers.append(stubber)
+        return iam
+
+    return client
+
+
+def run(user_count: int, accounts: int, workers: int) -> dict:
+    results: dict = {}
+    names = user_names(user_count)
+    report = credential_report(names)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        write_inputs(directory, names, accounts)
+
+        def load():
+            thresholds = find_stale_keys.load_thresholds(HERE / "thresholds.yml")
+            users = find_stale_keys.load_system_users(directory / "users.yaml", thresholds)
+            users += find_stale_keys.load_tf_users(directory / "tf-state.yml", thresholds)
+            users += find_stale_keys.load_other_users(directory / "other_iam_users.yml")
+            profiles, _ = find_stale_keys.load_profiles(
+                directory / "profiles.yml", directory / "profiles.yml")
+            return users, profiles
+
+        users, profiles = measure(results, "load", load)
+
+    index = measure(results, "index", UserIndex, users)
+    rows = measure(results, "parse", lambda: list(iter_report_rows(report)))
+    matched = measure(
+        results, "match", lambda: [find_stale_keys.find_known_user(row.user, index) for row in rows])
+
+    def emit():
+        key_info, registry = find_stale_keys.key_info_template()
+        for row, user in zip(rows, matched):
+            if user.account_type:
+                find_stale_keys.check_keys(user, row, "bench", key_info)
+        find_stale_keys.send_keys(registry, "bench", "us-east-1")
+
+    measure(results, "emit", emit)
+
+    scans = [
+        find_stale_keys.AccountScan("us-east-1", profile, index, account)
+        for account, profile in profiles.items()
+    ]
+    with patch.object(find_stale_keys.aws_clients, "client", side_effect=stubbed_clients(report)):
+        measure(
+            results, "scan", find_stale_keys.scan_accounts,
+            scans, max_workers=workers, account_timeout=3600)
+    failed = [scan for scan in scans if scan.status != "ok"]
+    if failed:
+        raise RuntimeError(f"benchmark scan failed: {failed[0].status}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark find_stale_keys")
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="credential report sizes to benchmark")
+    parser.add_argument("--accounts", type=int, default=4, help="accounts to scan")
+    parser.add_argument("--workers", type=int, default=4, help="accounts scanned at once")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PushgatewaySink)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    gateway = {"GATEWAY_HOST": "http://127.0.0.1", "GATEWAY_PORT": str(server.server_address[1])}
+    with patch.dict("os.environ", gateway):
+        find_stale_keys.env = Env()
+        find_stale_keys.metrics_sink = find_stale_keys.sink_from_env()
+
+        print(f"{'users':>8} {'stage':>6} {'seconds':>9} {'peak MiB':>9}")
+        for user_count in args.users:
+            for stage, (elapsed, peak) in run(user_count, args.accounts, args.workers).items():
+                print(f"{user_count:>8} {stage:>6} {elapsed:>9.3f} {peak / 2**20:>9.1f}")
+
+    server.shutdown()
+    print(f"pushgateway sink: {PushgatewaySink.requests} requests, {PushgatewaySink.bytes} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import csv
+import io
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, NamedTuple
+
+from botocore.exceptions import ClientError
+
+log = logging.getLogger(__name__)
+
+# Errors from get_credential_report that mean there isn't a usable report yet
+MISSING_REPORT_CODES = ("ReportNotPresent", "ReportExpired", "ReportInProgress")
+
+
+class ReportRow(NamedTuple):
+    """
+    The columns of a credential report row that are used for the credentials check
+    """
+    user: str
+    access_key_1_last_rotated: str
+    access_key_2_last_rotated: str
+
+
+class ReportTimeout(Exception):
+    """
+    The credential report was not generated before the deadline
+    """
+
+
+def backoff_delays(base: float, cap: float):
+    """
+    Exponential backoff with jitter: each delay doubles up to the cap, and a random
+    amount up to half of it is taken off so concurrent waiters don't poll in step
+    """
+    attempt = 0
+    while True:
+        delay = min(cap, base * 2**attempt)
+        yield delay / 2 + random.uniform(0, delay / 2)
+        attempt += 1
+
+
+def recent_report(iam, max_age: float) -> dict | None:
+    """
+    Return the account's current credential report if it was generated less than
+    max_age seconds ago, otherwise None
+    """
+    try:
+        report = iam.get_credential_report()
+    except ClientError as err:
+        if err.response["Error"]["Code"] in MISSING_REPORT_CODES:
+            return None
+        raise
+    age = datetime.now(timezone.utc) - report["GeneratedTime"]
+    if age <= timedelta(seconds=max_age):
+        return report
+    return None
+
+
+def wait_for_report(
+    iam, deadline: float, base_delay: float = 1.0, max_delay: float = 30.0
+):
+    """
+    Ask IAM to generate the credential report and poll until it is complete. Raises
+    ReportTimeout if it takes longer than deadline seconds.
+    """
+    give_up_at = time.monotonic() + deadline
+    for delay in backoff_delays(base_delay, max_delay):
+        if iam.generate_credential_report()["State"] == "COMPLETE":
+            return
+        remaining = give_up_at - time.monotonic()
+        if remaining <= 0:
+            raise ReportTimeout(f"credential report not ready after {deadline}s")
+        log.debug("credential report not ready, waiting %.1fs", min(delay, remaining))
+        time.sleep(min(delay, remaining))
+
+
+def fetch_credential_report(iam, max_age: float, deadline: float) -> dict:
+    """
+    Get the credential report for the account, reusing the existing one when it is
+    fresh enough. IAM only generates a new report every 4 hours anyway.
+    """
+    report = recent_report(iam, max_age)
+    if report is None:
+        wait_for_report(iam, deadline)
+        report = iam.get_credential_report()
+    return report
+
+
+def iter_report_rows(content: bytes) -> Iterator[ReportRow]:
+    """
+    Parse the credential report csv straight from the report bytes, one row at a time,
+    keeping only the ReportRow columns
+    """
+    reader = csv.reader(io.TextIOWrapper(io.BytesIO(content), encoding="utf-8", newline=""))
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [header.index(column) for column in ReportRow._fields]
+    for fields in reader:
+        # Skip blank lines, such as a trailing newline
+        if fields:
+            yield ReportRow._make([fields[column] for column in columns])
@@ -1,28 +1,72 @@
 #!/usr/bin/env python
 
 import argparse
+import logging
+import sys
+from pathlib import Path
+
+# Modules shared with the other collectors live in ci/common
+sys.path.append(str(Path(__file__).resolve().parent.parent / "common"))
 
-from copy import copy
-import csv
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
 
-from threshold import Threshold
+from aws_clients import ClientPool
+from credential_report import ReportRow, fetch_credential_report, iter_report_rows
+from job_logging import configure_logging
+from job_metrics import JobMetrics
+from push_ledger import PushLedger, payload_digest
+from pushgateway import group_labels, group_path
+from sinks import sink_from_env
+from threshold import UNKNOWN_USER, Threshold, policy_table
+from user_index import UserIndex
+from yaml_loader import YamlCache, extract_outputs
 
 # from alert import Alert
 from prometheus_client import (
+    CONTENT_TYPE_LATEST,
     CollectorRegistry,
     Gauge,
-    pushadd_to_gateway
+    generate_latest,
 )
-import boto3
-import yaml
 import time
-import sys
-import re
-from pathlib import Path
 from environs import Env
 from dateutil.parser import parse
 
-from datetime import datetime
+from datetime import date, datetime
+from functools import lru_cache
+
+log = logging.getLogger("find_stale_keys")
+
+# Shared by every account scan so the IAM service model is only loaded once
+aws_clients = ClientPool()
+# Captured once so every key in a run is measured against the same day
+run_date = datetime.today().date()
+# How the job itself performs, pushed at the end of the run
+job_metrics = JobMetrics("find_stale_keys")
+# What was last pushed for each account, replaced in main with the one kept between runs
+push_ledger = PushLedger()
+# Where the metrics go, the pushgateway or textfiles, chosen with METRICS_SINK
+metrics_sink = None
+
+
+class ScanDeadlineExceeded(Exception):
+    """
+    An account scan ran past its deadline, its keys are not pushed
+    """
+
+
+@dataclass
+class AccountScan:
+    """
+    One profile to search for stale keys, along with the result of the search
+    """
+    region_name: str
+    profile: dict
+    all_users: UserIndex
+    account: str
+    status: str = "pending"
+    elapsed: float = 0.0
 
 
 def main():
@@ -30,6 +74,7 @@ def main():
     This is where the loading of the various files for reference occurs. This also kicks off the process
     to find the stale keys and then push any alerts out as well.
     """
+    global push_ledger
 
     # First check to see if we're debugging, and set up paths accordingly
     local_env = Env()
@@ -43,11 +88,19 @@ def main():
     parser = argparse.ArgumentParser(
         description="Arguments for find_stale_keys")
     parser.add_argument(
-        "-d", "--debug", action="store_true", help="debug mode no levels for now"
+        "-d", "--debug", action="store_true",
+        help="debug mode, reads inputs relative to the repo and logs at DEBUG"
+    )
+    parser.add_argument(
+        "--log-json", action="store_true", default=local_env.str("LOG_FORMAT", "text") == "json",
+        help="log JSON lines instead of text, also set with LOG_FORMAT=json"
     )
     args = parser.parse_args()
     if args.debug:
         debug = True
+    configure_logging(
+        debug=debug, json_output=args.log_json, debug_loggers=["find_stale_keys", "credential_report"]
+    )
 
     # more debug setup
     if debug:
@@ -75,65 +128,172 @@ def main():
     to a warning of 300 days and a violation at 360 days This was decided based on a discussion with
     compliance over the finding related to stale keys
     """
-    thresholds = load_thresholds(thresholds_filename)
-    com_users_list = load_system_users(com_users_filename, thresholds)
-    gov_users_list = load_system_users(gov_users_filename, thresholds)
-    tf_users = load_tf_users(tf_state_filename, thresholds)
-    other_users = load_other_users(other_users_filename)
+    with job_metrics.stage("load"):
+        yaml_cache = YamlCache(local_env.str("YAML_CACHE_DIR", None))
+        thresholds = load_thresholds(thresholds_filename, yaml_cache)
+        com_users_list = load_system_users(com_users_filename, thresholds, yaml_cache)
+        gov_users_list = load_system_users(gov_users_filename, thresholds, yaml_cache)
+        tf_users = load_tf_users(tf_state_filename, thresholds, yaml_cache)
+        other_users = load_other_users(other_users_filename, yaml_cache)
+
+        (com_state_dict, gov_state_dict) = load_profiles(
+            com_state_file, gov_state_file)
+
+        push_ledger = PushLedger(
+            local_env.str("PUSH_LEDGER", None),
+            reconcile_interval=local_env.float("PUSH_RECONCILE_INTERVAL", 86400),
+            destination=metrics_sink.destination,
+        )
+
+        # The user lookups are built once and shared by every profile in the partition
+        all_com_users = UserIndex(com_users_list + tf_users + other_users)
+        all_gov_users = UserIndex(gov_users_list + tf_users + other_users)
+
+    scans = [
+        AccountScan(com_region, com_state_dict[com_key], all_com_users, com_key)
+        for com_key in com_state_dict
+    ] + [
+        AccountScan(gov_region, gov_state_dict[gov_key], all_gov_users, gov_key)
+        for gov_key in gov_state_dict
+    ]
+    # A reconcile is the first run after a deploy, or after the ledger was lost
+    if push_ledger.reconciling:
+        try:
+            for group in delete_legacy_groups(metrics_sink):
+                log.info("deleted a per-key %s group: %s", metrics_sink.name, group)
+        except Exception as err:
+            log.warning("could not delete the per-key groups: %r", err)
+
+    scan_accounts(
+        scans,
+        max_workers=local_env.int("SCAN_MAX_WORKERS", 8),
+        account_timeout=local_env.float("SCAN_ACCOUNT_TIMEOUT", 900),
+    )
+
+    # Log how every account went, then fail the job if any of them failed
+    failed = False
+    for scan in scans:
+        ok = scan.status == "ok"
+        log.log(
+            logging.INFO if ok else logging.ERROR,
+            "%s %s: %s (%.1fs)", scan.region_name, scan.account, scan.status, scan.elapsed,
+            extra={"account": scan.account, "region": scan.region_name,
+                   "status": scan.status, "elapsed": round(scan.elapsed, 3)},
+        )
+        failed = failed or not ok
+
+    # Accounts that are still around keep their group even if their scan failed,
+    # only the groups of accounts that are gone are deleted
+    current_groups = {account_group(scan.account, scan.region_name) for scan in scans}
+    current_groups.add(job_metrics.group())
+    try:
+        for group in push_ledger.delete_vanished(metrics_sink, "find_stale_keys", current_groups):
+            log.info("deleted the %s group of a vanished account: %s", metrics_sink.name, group)
+    except Exception as err:
+        log.warning("could not delete vanished groups: %r", err)
+    push_ledger.save()
 
-    (com_state_dict, gov_state_dict) = load_profiles(
-        com_state_file, gov_state_file)
+    # Not being able to report on the job itself shouldn't fail it
+    try:
+        job_metrics.send(metrics_sink)
+    except Exception as err:
+        log.warning("could not push job metrics: %r", err)
 
-    for com_key in com_state_dict:
-        all_com_users = com_users_list + tf_users + other_users
-        search_for_keys(
-            com_region, com_state_dict[com_key], all_com_users, com_key)
-    for gov_key in gov_state_dict:
-        all_gov_users = gov_users_list + tf_users + other_users
-        search_for_keys(
-            gov_region, gov_state_dict[gov_key], all_gov_users, gov_key)
+    if failed:
+        sys.exit(1)
+
+
+def delete_legacy_groups(sink) -> list[str]:
+    """
+    Keys used to be pushed to a group of their own, grouped by user, key_num,
+    user_type and account. Those groups hold the same series as the account groups,
+    which the pushgateway refuses to take, so they're deleted before any account is
+    pushed.
+    """
+    legacy = sorted(group for group in sink.groups("find_stale_keys") if "user" in group_labels(group))
+    for group in legacy:
+        sink.delete(group)
+    return legacy
 
 
-def load_thresholds(filename: str) -> list[Threshold]:
+def scan_accounts(scans: list[AccountScan], max_workers: int, account_timeout: float):
+    """
+    Search all the accounts for stale keys at the same time, with at most max_workers
+    running at once. A failure in one account is recorded in its status and doesn't stop
+    the others. Accounts that run longer than account_timeout seconds are marked as timed
+    out and no longer waited on. Their scan is given the same deadline, so it stops
+    waiting on the credential report and doesn't push once it has passed.
+    """
+    started: dict[int, float] = {}
+
+    def run(position: int, scan: AccountScan):
+        started[position] = time.monotonic()
+        search_for_keys(
+            scan.region_name, scan.profile, scan.all_users, scan.account,
+            deadline=started[position] + account_timeout,
+        )
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {
+        executor.submit(run, position, scan): position
+        for position, scan in enumerate(scans)
+    }
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+        now = time.monotonic()
+        for future in done:
+            scan = scans[futures[future]]
+            scan.elapsed = now - started[futures[future]]
+            try:
+                future.result()
+                scan.status = "ok"
+            except Exception as err:
+                scan.status = f"failed: {err!r}"
+        for future in list(pending):
+            position = futures[future]
+            if position in started and now - started[position] > account_timeout:
+                scans[position].elapsed = now - started[position]
+                scans[position].status = "timed out"
+                pending.discard(future)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def load_thresholds(filename: str, yaml_cache: YamlCache | None = None) -> dict[str, Threshold]:
     """
     This is the file that holds all the threshold information to be added to
     the user list dictionaries. This might be changed later to include what type of user
-    as the threshold limits are now coded in the rules for alertmanager
+    as the threshold limits are now coded in the rules for alertmanager.
+    Returns the policy table of thresholds keyed by account type.
     """
-    with open(filename) as f:
-        thresholds_yaml = yaml.safe_load(f)
-    return [Threshold(**threshold) for threshold in thresholds_yaml]
+    thresholds_yaml = (yaml_cache or YamlCache()).load(filename)
+    return policy_table([Threshold(**threshold) for threshold in thresholds_yaml])
 
 
-def get_platform_thresholds(thresholds: list[Threshold], account_type: str):
-    found_thresholds = [
-        threshold_dict
-        for threshold_dict in thresholds
-        if threshold_dict.account_type == account_type
-    ]
-    if found_thresholds:
-        return copy(found_thresholds[0])
-    else:
-        return None
+def get_platform_thresholds(thresholds: dict[str, Threshold], account_type: str) -> Threshold | None:
+    return thresholds.get(account_type)
 
 
 def format_user_dicts(
-    users_list: list, thresholds: list[Threshold], account_type
-) -> list[Threshold]:
+    users_list: list, thresholds: dict[str, Threshold], account_type
+) -> list[Threshold | None]:
     """
-    Augment the users list to have the threshold information.
+    Augment the users list to have the threshold information. The account type is
+    looked up once, every user gets a record built from the same thresholds.
     """
-    augmented_user_list = []
-    for key in users_list:
-        found_user_threshold = get_platform_thresholds(
-            thresholds, account_type)
-        if found_user_threshold:
-            found_user_threshold.user = key
-        augmented_user_list.append(found_user_threshold)
-    return augmented_user_list
+    found_threshold = get_platform_thresholds(thresholds, account_type)
+    if found_threshold is None:
+        return [None] * len(users_list)
+    return [replace(found_threshold, user=key) for key in users_list]
+
 
+def sso_user_names(users_yaml: dict) -> list[str]:
+    return list(users_yaml["users"])
 
-def load_system_users(filename: Path, thresholds: list[Threshold]) -> list[Threshold]:
+
+def load_system_users(
+    filename: Path, thresholds: dict[str, Threshold], yaml_cache: YamlCache | None = None
+) -> list[Threshold | None]:
     """
     Schema for gov or com users after pull out the "users" dict
     {"user.name":{'aws_groups': ['Operators', 'OrgAdmins']}}
@@ -141,13 +301,26 @@ def load_system_users(filename: Path, thresholds: list[Threshold]) -> list[Thres
     {"user":user_name, "account_type":"Operators"} - note Operators is
     hardcoded for now
     """
-    with open(filename) as f:
-        users_list = list(yaml.safe_load(f)["users"])
+    users_list = (yaml_cache or YamlCache()).load(filename, sso_user_names)
     users_list = format_user_dicts(users_list, thresholds, "Operator")
     return users_list
 
 
-def load_tf_users(tf_filename: Path, thresholds: list[Threshold]) -> list[Threshold]:
+def is_username_output(key: str) -> bool:
+    return "username" in key
+
+
+def is_stalekey_output(key: str) -> bool:
+    return key.endswith("stalekey")
+
+
+def tf_user_names(tf_state: bytes) -> list[str]:
+    return list(extract_outputs(tf_state, is_username_output).values())
+
+
+def load_tf_users(
+    tf_filename: Path, thresholds: dict[str, Threshold], yaml_cache: YamlCache | None = None
+) -> list[Threshold]:
     """
     Schema for tf_users - need to verify this is correct
     {
@@ -161,20 +334,14 @@ def load_tf_users(tf_filename: Path, thresholds: list[Threshold]) -> list[Thresh
     Note that all values are hardcoded except the username
     This file is scraped for more users to search for stale keys
     """
-    tf_users: list[Threshold] = []
-    with open(tf_filename) as f:
-        tf_yaml = yaml.safe_load(f)
-    outputs = tf_yaml["terraform_outputs"]
-    for key in list(outputs):
-        if "username" in key:
-            found_user_threshold = get_platform_thresholds(
-                thresholds, "Platform")
-            found_user_threshold.user = outputs[key]
-            tf_users.append(found_user_threshold)
-    return tf_users
+    tf_user_list = (yaml_cache or YamlCache()).load(tf_filename, tf_user_names, streaming=True)
+    platform_threshold = get_platform_thresholds(thresholds, "Platform")
+    return [replace(platform_threshold, user=user_name) for user_name in tf_user_list]
 
 
-def load_other_users(other_users_filename: Path) -> list[Threshold]:
+def load_other_users(
+    other_users_filename: Path, yaml_cache: YamlCache | None = None
+) -> list[Threshold]:
     """
     Schema for other_users is
     {   user: user_name,
@@ -187,8 +354,7 @@ def load_other_users(other_users_filename: Path) -> list[Threshold]:
     Note that all values are hardcoded in the yaml
     Threshold is a dataclass which has the properties in the above schema
     """
-    with open(other_users_filename) as f:
-        other_users_yaml = yaml.safe_load(f)
+    other_users_yaml = (yaml_cache or YamlCache()).load(other_users_filename)
 
     return [Threshold(**other) for other in other_users_yaml]
 
@@ -200,8 +366,8 @@ def state_file_to_dict(all_outputs: dict):
     """
     output_dict = {}
     for key, value in all_outputs.items():
-        if key.endswith("stalekey"):
-            new_key = re.sub("_.*", "", key)
+        if is_stalekey_output(key):
+            new_key = key.partition("_")[0]
             if new_key not in output_dict:
                 output_dict[new_key] = {}
             if "id" in key:
@@ -216,21 +382,20 @@ def load_profiles(com_state_file: Path, gov_state_file: Path):
     """
     Clean up yaml from state files for com and gov
     These are the secrets used for assume_role to pull
-    user info from the accounts
-    """
-    with com_state_file.open() as f:
-        com_state = yaml.safe_load(f)
-    with gov_state_file.open() as f:
-        gov_state = yaml.safe_load(f)
-    all_outputs_com = com_state["terraform_outputs"]
-    all_outputs_gov = gov_state["terraform_outputs"]
+    user info from the accounts. They are never written to the yaml cache.
+    """
+    with com_state_file.open("rb") as f:
+        all_outputs_com = extract_outputs(f, is_stalekey_output)
+    with gov_state_file.open("rb") as f:
+        all_outputs_gov = extract_outputs(f, is_stalekey_output)
     com_state_dict = state_file_to_dict(all_outputs_com)
     gov_state_dict = state_file_to_dict(all_outputs_gov)
     return com_state_dict, gov_state_dict
 
 
 def search_for_keys(
-    region_name: str, profile: dict, all_users: list[Threshold], account: str
+    region_name: str, profile: dict, all_users: UserIndex, account: str,
+    deadline: float | None = None,
 ):
     """
     The main search function that reaches out to AWS IAM to grab the
@@ -238,62 +403,95 @@ def search_for_keys(
     This list is then used to determine the number of days since rotation of the users active key(s)
     The user info and the days since rotation is sent to Prometheus for it to use internal rules to determine
     what is alerted on. Note that some of that is configurable in the thresholds.
+    deadline is a time.monotonic() value, the scan raises ScanDeadlineExceeded instead
+    of pushing once it has passed.
     """
 
-    # First let's get a session based on the user access key,
-    # so we can get all the users for a given account via the Python boto3 lib
-    session = boto3.Session(
+    # First let's get a client based on the user access key,
+    # so we can get all the users for a given account via botocore
+    iam = aws_clients.client(
+        "iam",
         region_name=region_name,
         aws_access_key_id=profile["id"],
         aws_secret_access_key=profile["secret"]
     )
-    iam = session.client("iam")
-
-    # Generate credential report for the given profile
-    # Generating the report is an async operation, so wait for it by sleeping
-    # If Python has async await type of construct it would be good to use here
-    w_time = 0
-
-    while iam.generate_credential_report()["State"] != "COMPLETE":
-        w_time = w_time + 5
-        print("Waiting...{}".format(w_time))
-        time.sleep(w_time)
-    report = iam.get_credential_report()
-    content = report["Content"].decode("utf-8")
-    content_lines = content.split("\n")
-
-    # Convert the csv contents to a list and turn each row into a dictionary to use for the credentials check
-    csv_reader = csv.DictReader(content_lines, delimiter=",")
-    row: dict
-    for row in csv_reader:
-        user_name = row["user"]
+    job_metrics.instrument(iam)
+
+    # Get the credential report for the given profile, reusing a recent one if there is one.
+    # Generating the report is an async operation, so wait for it with backoff up to a deadline
+    report_deadline = env.float("CREDENTIAL_REPORT_DEADLINE", 600)
+    if deadline is not None:
+        report_deadline = min(report_deadline, deadline - time.monotonic())
+    with job_metrics.stage("report_wait"):
+        report = fetch_credential_report(
+            iam,
+            max_age=env.float("CREDENTIAL_REPORT_MAX_AGE", 14400),
+            deadline=report_deadline,
+        )
+    # All of the keys for the account are collected into one registry so they
+    # can be sent to the pushgateway in a single request
+    key_info, registry = key_info_template()
+
+    # Stream the csv contents, keeping only the columns used for the credentials check
+    row: ReportRow
+    match_seconds = 0.0
+    users = known_users = keys = 0
+    for row in job_metrics.timed(iter_report_rows(report["Content"]), "report_parse"):
+        started = time.monotonic()
+        user_name = row.user
+        users += 1
         # Note: If the user is unknown, we aren't capturing it, but could we could in an else below
         aws_user = find_known_user(user_name, all_users)
-        print(f"about to check user: {aws_user}")
+        log.debug("%s: checking user %s (%s)", account, user_name, aws_user.account_type or "unknown")
         if len(aws_user.account_type) > 0:
-            check_keys(aws_user, row, account)
+            known_users += 1
+            keys += check_keys(aws_user, row, account, key_info)
+        match_seconds += time.monotonic() - started
+    job_metrics.add_stage("match", match_seconds)
+
+    # The run has stopped waiting on this account, don't push behind its back
+    if deadline is not None and time.monotonic() > deadline:
+        raise ScanDeadlineExceeded(f"{account}: scan deadline passed before the push")
+    with job_metrics.stage("push"):
+        send_keys(registry, account, region_name)
+    log.info(
+        "%s: %d users in the credential report, %d known, %d keys sent",
+        account, users, known_users, keys,
+        extra={"account": account, "users": users, "known_users": known_users, "keys": keys},
+    )
 
 
-def find_known_user(report_user: str, aws_users: list[Threshold]) -> Threshold:
+def find_known_user(
+    report_user: str, aws_users: UserIndex | list[Threshold]
+) -> Threshold:
     """
     Return the row as a Threshold, from the users dictionary matching the
     report user if it exists. This will be used for validating thresholds for
-    the key rotation date timeframes
+    the key rotation date timeframes. Wildcard users match anywhere in the
+    report user name, all others have to match exactly. The matching record itself
+    is returned, shared with every other lookup, and UNKNOWN_USER when nothing matches.
     """
-    aws_user = Threshold(
-        account_type="", is_wildcard=False, warn=0, violation=0, alert=False
-    )
+    if not isinstance(aws_users, UserIndex):
+        aws_users = UserIndex(aws_users)
+    return aws_users.match(report_user) or UNKNOWN_USER
 
-    found = [aws_user for aws_user in aws_users if aws_user.user in report_user]
-    if found:
-        aws_user = copy(found[0])
-    return aws_user
+
+@lru_cache(maxsize=4096)
+def parse_rotation_date(last_rotated: str) -> date:
+    """
+    IAM writes ISO-8601 timestamps, which fromisoformat handles much faster than
+    dateutil. Anything else still goes through dateutil. Like ignoretz, the date is
+    taken as written rather than converted to local time.
+    """
+    try:
+        return datetime.fromisoformat(last_rotated).date()
+    except ValueError:
+        return parse(last_rotated, ignoretz=True).date()
 
 
-def calc_days_since_rotation(last_rotated: str) -> int:
-    last_rotated_date = parse(last_rotated, ignoretz=True)
-    today = datetime.today()
-    delta = today.date() - last_rotated_date.date()
+def calc_days_since_rotation(last_rotated: str, today: date | None = None) -> int:
+    last_rotated_date = parse_rotation_date(last_rotated)
+    delta = (today or run_date) - last_rotated_date
     last_rotated_days = delta.days
     return last_rotated_days
 
@@ -313,62 +511,76 @@ def key_info_template() -> (Gauge, CollectorRegistry):
     return key_info, registry
 
 
-def send_key(key_dict: dict):
-    """
-    Send the key(s) to the pushgateway client to later have the alertmanager determine if they are stale
-    """
-    gateway = f"{env.str('GATEWAY_HOST')}:{env.int('GATEWAY_PORT', 9091)}"
-    days_since_rotation = key_dict["days_since_rotation"]
-    del key_dict["days_since_rotation"]
+def account_group(account: str, region_name: str) -> str:
+    # com and gov profiles can have the same account name, the region keeps them apart
+    return group_path("find_stale_keys", {"account": account, "region": region_name})
 
-    key_info, registry = key_info_template()
 
-    key_info.labels(**key_dict).set(days_since_rotation)
-    pushadd_to_gateway(
-        gateway, job="find_stale_keys", registry=registry, grouping_key=key_dict
-    )
+def send_keys(registry: CollectorRegistry, account: str, region_name: str):
+    """
+    Send all the keys for an account to the metrics sink in one write to later have
+    the alertmanager determine if they are stale. The write replaces the whole account group,
+    so keys that no longer exist in the account are dropped. Accounts whose keys haven't
+    changed since the last write are skipped.
+    """
+    payload = generate_latest(registry)
+    group = account_group(account, region_name)
+    digest = payload_digest(payload)
+    if not push_ledger.needs_push(group, digest):
+        log.debug("%s: keys unchanged since the last push", account)
+        return
+    job_metrics.record_payload(metrics_sink.name, len(payload))
+    metrics_sink.send(group, payload, {"Content-Type": CONTENT_TYPE_LATEST})
+    push_ledger.record(group, digest)
 
 
 def check_key(
-    key_num: int, last_rotated_key: str, user: Threshold, row: dict, account: str
+    key_num: int,
+    last_rotated_key: str,
+    user: Threshold,
+    row: ReportRow,
+    account: str,
+    key_info: Gauge,
 ):
     """
     Where the real work happens, check for the date last rotated for both violation and warning thresholds
     """
     days_since_rotation = calc_days_since_rotation(last_rotated_key)
-    user_dict = {
-        "user": row["user"],
-        "key_num": key_num,
-        "user_type": user.account_type,
-        "account": account,
-        "days_since_rotation": days_since_rotation
-    }
-    print(f"user is either being sent or deleted: {user_dict}")
-    send_key(user_dict)
+    log.debug(
+        "%s: key %d of %s (%s) last rotated %d days ago",
+        account, key_num, row.user, user.account_type, days_since_rotation,
+    )
+    key_info.labels(
+        user=row.user, key_num=key_num, user_type=user.account_type, account=account
+    ).set(days_since_rotation)
 
 
-def check_keys(user: Threshold, row: dict, account: str):
+def check_keys(user: Threshold, row: ReportRow, account: str, key_info: Gauge) -> int:
     """
-    Pull apart the row to get to each of the access keys to check for days since rotation
+    Pull apart the row to get to each of the access keys to check for days since rotation.
+    Returns how many keys were recorded.
     """
-    last_rotated_key1 = row["access_key_1_last_rotated"]
-    last_rotated_key2 = row["access_key_2_last_rotated"]
+    last_rotated_key1 = row.access_key_1_last_rotated
+    last_rotated_key2 = row.access_key_2_last_rotated
 
     # If we want to alert customers we'll need to modify the alert setting
     # in their threshold to true
     if user.alert:
         if last_rotated_key1 != "N/A":
-            check_key(1, last_rotated_key1, user, row, account)
+            check_key(1, last_rotated_key1, user, row, account, key_info)
+            return 1
         elif last_rotated_key2 != "N/A":
-            check_key(2, last_rotated_key2, user, row, account)
+            check_key(2, last_rotated_key2, user, row, account, key_info)
+            return 1
+    return 0
 
 
 if __name__ == "__main__":
-    # Set up the GATEWAY to send alerts to Prometheus
+    # Set up the sink, by default the GATEWAY, to send alerts to Prometheus
     env = Env()
     try:
-        env.str("GATEWAY_HOST")
+        metrics_sink = sink_from_env()
     except ValueError as err:
-        print(f"GATEWAY_HOST missing: {err}")
+        print(f"Metrics sink not configured: {err}")
         sys.exit(1)
     main()
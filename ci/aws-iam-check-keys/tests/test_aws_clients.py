@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from aws_clients import ClientPool
+
+
+class TestClientPool(TestCase):
+    def setUp(self):
+        self.pool = ClientPool(max_pool_connections=4)
+
+    def client(self, access_key_id="AKIA1", region_name="us-east-1"):
+        return self.pool.client(
+            "iam",
+            region_name=region_name,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key="secret",
+        )
+
+    def test_clients_are_reused_per_credentials(self):
+        self.assertIs(self.client(), self.client())
+        self.assertIsNot(self.client("AKIA1"), self.client("AKIA2"))
+        self.assertIsNot(self.client(region_name="us-gov-west-1"), self.client())
+
+    def test_clients_share_connection_settings(self):
+        client = self.client()
+        self.assertEqual(client.meta.config.max_pool_connections, 4)
+        self.assertTrue(client.meta.config.tcp_keepalive)
+        self.assertEqual(client.meta.config.connect_timeout, 10)
+        self.assertEqual(client.meta.config.read_timeout, 30)
+
+    def test_clients_created_from_threads(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            clients = list(executor.map(self.client, ["AKIA" + str(n % 3) for n in range(24)]))
+        self.assertEqual(len({id(client) for client in clients}), 3)
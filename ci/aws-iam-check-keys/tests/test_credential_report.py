@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+import credential_report
+
+
+def client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "GetCredentialReport")
+
+
+class TestCredentialReport(TestCase):
+    def test_backoff_delays_grow_to_cap(self):
+        delays = credential_report.backoff_delays(1, 8)
+        bounds = [1, 2, 4, 8, 8, 8]
+        for bound in bounds:
+            delay = next(delays)
+            self.assertGreaterEqual(delay, bound / 2)
+            self.assertLessEqual(delay, bound)
+
+    def test_recent_report_is_reused(self):
+        iam = MagicMock()
+        iam.get_credential_report.return_value = {
+            "GeneratedTime": datetime.now(timezone.utc) - timedelta(hours=1),
+            "Content": b"user\n",
+        }
+
+        report = credential_report.fetch_credential_report(iam, max_age=14400, deadline=60)
+
+        self.assertEqual(report["Content"], b"user\n")
+        iam.generate_credential_report.assert_not_called()
+
+    @patch("credential_report.time.sleep")
+    def test_old_report_is_regenerated(self, sleep):
+        iam = MagicMock()
+        old = {"GeneratedTime": datetime.now(timezone.utc) - timedelta(hours=5)}
+        new = {"GeneratedTime": datetime.now(timezone.utc)}
+        iam.get_credential_report.side_effect = [old, new]
+        iam.generate_credential_report.side_effect = [
+            {"State": "STARTED"},
+            {"State": "INPROGRESS"},
+            {"State": "COMPLETE"},
+        ]
+
+        report = credential_report.fetch_credential_report(iam, max_age=14400, deadline=60)
+
+        self.assertIs(report, new)
+        self.assertEqual(sleep.call_count, 2)
+
+    @patch("credential_report.time.sleep")
+    def test_missing_report_is_generated(self, sleep):
+        iam = MagicMock()
+        new = {"GeneratedTime": datetime.now(timezone.utc)}
+        iam.get_credential_report.side_effect = [client_error("ReportNotPresent"), new]
+        iam.generate_credential_report.return_value = {"State": "COMPLETE"}
+
+        report = credential_report.fetch_credential_report(iam, max_age=14400, deadline=60)
+
+        self.assertIs(report, new)
+        sleep.assert_not_called()
+
+    def test_other_errors_are_raised(self):
+        iam = MagicMock()
+        iam.get_credential_report.side_effect = client_error("AccessDenied")
+
+        with self.assertRaises(ClientError):
+            credential_report.fetch_credential_report(iam, max_age=14400, deadline=60)
+
+    @patch("credential_report.time.sleep")
+    @patch("credential_report.time.monotonic")
+    def test_wait_gives_up_at_deadline(self, monotonic, sleep):
+        monotonic.side_effect = [0, 10, 20, 30, 40]
+        iam = MagicMock()
+        iam.generate_credential_report.return_value = {"State": "INPROGRESS"}
+
+        with self.assertRaises(credential_report.ReportTimeout):
+            credential_report.wait_for_report(iam, deadline=25)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_iter_report_rows_keeps_needed_columns(self):
+        content = (
+            b"user,arn,access_key_1_active,access_key_1_last_rotated,"
+            b"access_key_2_active,access_key_2_last_rotated\n"
+            b"<root_account>,arn:aws:iam::1:root,false,N/A,false,N/A\n"
+            b"robert.gottlieb,arn:aws:iam::1:user/robert.gottlieb,true,"
+            b"2023-04-12T21:23:58+00:00,false,N/A\n"
+        )
+
+        rows = list(credential_report.iter_report_rows(content))
+
+        self.assertEqual(
+            rows,
+            [
+                credential_report.ReportRow("<root_account>", "N/A", "N/A"),
+                credential_report.ReportRow(
+                    "robert.gottlieb", "2023-04-12T21:23:58+00:00", "N/A"
+                ),
+            ],
+        )
+
+    def test_iter_report_rows_empty_report(self):
+        self.assertEqual(list(credential_report.iter_report_rows(b"")), [])
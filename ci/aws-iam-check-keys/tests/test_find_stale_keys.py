@@ -1,11 +1,15 @@
+import time
 from datetime import datetime
-from unittest.mock import patch
+from threading import Event
+from unittest.mock import MagicMock, patch
 from unittest import TestCase
 
 from botocore.utils import datetime2timestamp
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 import find_stale_keys
-from threshold import Threshold
+from credential_report import ReportRow
+from threshold import UNKNOWN_USER, Threshold, policy_table
 
 
 class Test(TestCase):
@@ -93,6 +97,22 @@ class Test(TestCase):
         expected = 0
         self.assertEqual(actual, expected)
 
+    def test_calc_days_since_rotation(self):
+        today = datetime(2024, 4, 12).date()
+        for last_rotated in [
+            "2023-04-12T21:23:58+00:00",
+            "2023-04-12T23:59:59-05:00",
+            "2023-04-12 21:23:58",
+            "April 12 2023",
+        ]:
+            self.assertEqual(
+                find_stale_keys.calc_days_since_rotation(last_rotated, today), 366
+            )
+
+    def test_calc_days_since_rotation_uses_run_date(self):
+        last_rotated = f"{find_stale_keys.run_date}T00:00:00+00:00"
+        self.assertEqual(find_stale_keys.calc_days_since_rotation(last_rotated), 0)
+
     def test_find_known_user(self):
         # This should fail due to typo in name
         actual = find_stale_keys.find_known_user(
@@ -148,6 +168,117 @@ class Test(TestCase):
         )
         self.assertEqual(actual, expected)
 
+    def test_known_users_share_their_threshold_records(self):
+        self.assertIs(find_stale_keys.find_known_user("Ben", self.aws_users), self.aws_users[0])
+        self.assertIs(find_stale_keys.find_known_user("nobody", self.aws_users), UNKNOWN_USER)
+
+        thresholds = policy_table([
+            Threshold(account_type="Operator", is_wildcard=True, warn=300, violation=360, alert=True),
+            Threshold(account_type="Operator", is_wildcard=False, warn=1, violation=2, alert=False),
+        ])
+        users = find_stale_keys.format_user_dicts(["Ben", "Mark"], thresholds, "Operator")
+        self.assertEqual([user.user for user in users], ["Ben", "Mark"])
+        self.assertEqual(users[0].warn, 300)
+        self.assertEqual(find_stale_keys.format_user_dicts(["Ben"], thresholds, "Platform"), [None])
+
+    def test_check_keys_collects_into_one_registry(self):
+        key_info, registry = find_stale_keys.key_info_template()
+        row = ReportRow(*(self.test_dict[column] for column in ReportRow._fields))
+        self.assertEqual(find_stale_keys.check_keys(self.aws_users[3], row, "com", key_info), 1)
+        row = row._replace(user="james.smith")
+        self.assertEqual(find_stale_keys.check_keys(self.aws_users[5], row, "com", key_info), 1)
+
+        samples = list(registry.collect())[0].samples
+        self.assertEqual(len(samples), 2)
+        self.assertEqual(
+            {sample.labels["user"] for sample in samples},
+            {"robert.gottlieb", "james.smith"},
+        )
+
+    @patch("find_stale_keys.metrics_sink")
+    def test_send_keys_pushes_account_group(self, metrics_sink):
+        key_info, registry = find_stale_keys.key_info_template()
+
+        find_stale_keys.send_keys(registry, "com", "us-east-1")
+
+        metrics_sink.send.assert_called_once_with(
+            "/metrics/job/find_stale_keys/account/com/region/us-east-1",
+            generate_latest(registry),
+            {"Content-Type": CONTENT_TYPE_LATEST},
+        )
+
+        # A gov profile with the same account name gets a group of its own
+        find_stale_keys.send_keys(registry, "com", "us-gov-west-1")
+        self.assertEqual(
+            metrics_sink.send.call_args.args[0], "/metrics/job/find_stale_keys/account/com/region/us-gov-west-1")
+
+    @patch("find_stale_keys.metrics_sink")
+    def test_send_keys_skips_unchanged_accounts(self, metrics_sink):
+        ledger = find_stale_keys.PushLedger()
+        ledger.reconciling = False
+        key_info, registry = find_stale_keys.key_info_template()
+        key_info.labels(user="u", key_num=1, user_type="Operator", account="com").set(10)
+
+        with patch("find_stale_keys.push_ledger", ledger):
+            find_stale_keys.send_keys(registry, "com", "us-east-1")
+            find_stale_keys.send_keys(registry, "com", "us-east-1")
+            key_info.labels(user="u", key_num=1, user_type="Operator", account="com").set(11)
+            find_stale_keys.send_keys(registry, "com", "us-east-1")
+
+        self.assertEqual(metrics_sink.send.call_count, 2)
+
+    def test_delete_legacy_groups(self):
+        account = find_stale_keys.group_path("find_stale_keys", {"account": "com"})
+        legacy = find_stale_keys.group_path(
+            "find_stale_keys", {"user": "u", "key_num": 1, "user_type": "Operator", "account": "com"})
+        sink = MagicMock()
+        sink.groups.return_value = {account, legacy}
+
+        self.assertEqual(find_stale_keys.delete_legacy_groups(sink), [legacy])
+        sink.delete.assert_called_once_with(legacy)
+
+    @patch("find_stale_keys.search_for_keys")
+    def test_scan_accounts_isolates_failures(self, search_for_keys):
+        release = Event()
+
+        def search(region_name, profile, all_users, account, deadline):
+            if account == "broken":
+                raise RuntimeError("no report")
+            if account == "slow":
+                release.wait(5)
+
+        search_for_keys.side_effect = search
+        scans = [
+            find_stale_keys.AccountScan("us-east-1", {}, None, account)
+            for account in ["ok", "broken", "slow"]
+        ]
+
+        find_stale_keys.scan_accounts(scans, max_workers=3, account_timeout=0.1)
+        release.set()
+
+        self.assertEqual(scans[0].status, "ok")
+        self.assertIn("no report", scans[1].status)
+        self.assertEqual(scans[2].status, "timed out")
+        self.assertEqual(search_for_keys.call_count, 3)
+
+    @patch("find_stale_keys.send_keys")
+    @patch("find_stale_keys.fetch_credential_report")
+    @patch("find_stale_keys.aws_clients")
+    @patch("find_stale_keys.env", create=True)
+    def test_search_for_keys_stops_at_the_deadline(self, env, aws_clients, fetch_credential_report, send_keys):
+        env.float.side_effect = lambda name, default: default
+        fetch_credential_report.return_value = {"Content": b""}
+        deadline = time.monotonic() + 60
+
+        find_stale_keys.search_for_keys("us-east-1", {"id": "a", "secret": "s"}, [], "com", deadline=deadline)
+        self.assertLessEqual(fetch_credential_report.call_args.kwargs["deadline"], 60)
+        send_keys.assert_called_once()
+
+        with self.assertRaises(find_stale_keys.ScanDeadlineExceeded):
+            find_stale_keys.search_for_keys(
+                "us-east-1", {"id": "a", "secret": "s"}, [], "com", deadline=time.monotonic())
+        send_keys.assert_called_once()
+
     def test_send_data_via_client(self):
         find_stale_keys.send_data_via_client()
         
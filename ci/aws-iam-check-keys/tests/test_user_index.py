@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+from threshold import Threshold
+from user_index import UserIndex
+
+
+def make_user(user: str, is_wildcard: bool, account_type: str = "Platform"):
+    return Threshold(
+        account_type=account_type,
+        is_wildcard=is_wildcard,
+        warn=300,
+        violation=360,
+        alert=True,
+        user=user,
+    )
+
+
+class TestUserIndex(TestCase):
+    def test_exact_match(self):
+        index = UserIndex([make_user("Ben", False), make_user("Mark", False)])
+        self.assertEqual(index.match("Mark").user, "Mark")
+        self.assertIsNone(index.match("Benjamin"))
+        self.assertIsNone(index.match("nobody"))
+
+    def test_wildcard_matches_substring(self):
+        index = UserIndex([make_user("cg-s3-", True), make_user("ecr", True)])
+        self.assertEqual(index.match("cg-s3-1234abcd").user, "cg-s3-")
+        self.assertEqual(index.match("cg-ecr-broker").user, "ecr")
+        self.assertIsNone(index.match("cg-s4-1234abcd"))
+
+    def test_overlapping_wildcards(self):
+        # "bcd" is only found by following the failure link out of "abce"
+        index = UserIndex([make_user("abce", True), make_user("bcd", True)])
+        self.assertEqual(index.match("xabcd").user, "bcd")
+        self.assertEqual(index.match("abce").user, "abce")
+
+    def test_first_listed_user_wins(self):
+        users = [
+            make_user("cg-s3-bucket", True, "Customer"),
+            make_user("bucket", True, "Platform"),
+            make_user("cg-s3-bucket-user", False, "Operator"),
+        ]
+        index = UserIndex(users)
+        self.assertEqual(index.match("cg-s3-bucket-user").account_type, "Customer")
+
+        index = UserIndex(list(reversed(users)))
+        self.assertEqual(index.match("cg-s3-bucket-user").account_type, "Operator")
+        self.assertEqual(index.match("my-bucket").account_type, "Platform")
+
+    def test_missing_thresholds_are_skipped(self):
+        index = UserIndex([None, make_user("Ben", False)])
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.match("Ben").user, "Ben")
@@ -0,0 +1,93 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+import yaml_loader
+from yaml_loader import YamlCache
+
+
+def user_names(document):
+    return list(document["users"])
+
+
+class TestYamlCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+        self.users_file = self.path / "users.yaml"
+        self.users_file.write_text("users:\n  ben: {}\n  mark: {}\n")
+        self.cache = YamlCache(self.path / "cache")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_unchanged_file_is_not_parsed_again(self):
+        with patch("yaml_loader.safe_load", wraps=yaml_loader.safe_load) as safe_load:
+            self.assertEqual(self.cache.load(self.users_file, user_names), ["ben", "mark"])
+            self.assertEqual(self.cache.load(self.users_file, user_names), ["ben", "mark"])
+        self.assertEqual(safe_load.call_count, 1)
+
+    def test_changed_file_is_parsed_again(self):
+        self.cache.load(self.users_file, user_names)
+        self.users_file.write_text("users:\n  james: {}\n")
+
+        self.assertEqual(self.cache.load(self.users_file, user_names), ["james"])
+
+    def test_extract_functions_are_cached_separately(self):
+        self.assertEqual(self.cache.load(self.users_file, user_names), ["ben", "mark"])
+        self.assertEqual(
+            self.cache.load(self.users_file),
+            {"users": {"ben": {}, "mark": {}}},
+        )
+        self.assertEqual(len(list((self.path / "cache").glob("*.pickle"))), 2)
+
+    def test_corrupt_entry_is_replaced(self):
+        self.cache.load(self.users_file, user_names)
+        for entry in (self.path / "cache").glob("*.pickle"):
+            entry.write_bytes(b"not a pickle")
+
+        self.assertEqual(self.cache.load(self.users_file, user_names), ["ben", "mark"])
+
+    def test_without_cache_dir(self):
+        self.assertEqual(YamlCache().load(self.users_file, user_names), ["ben", "mark"])
+        self.assertFalse((self.path / "cache").exists())
+
+
+STATE = """
+terraform_version: 1.5.0
+modules:
+  - outputs: {cg_stalekey: nested}
+    resources: [1, 2, [3, 4]]
+terraform_outputs:
+  big_list:
+    - {cg_username: "not this one"}
+    - [username]
+  cg_username: cg-user
+  count_username: 12
+  quoted_username: "12"
+  flag_username: true
+  nested_username: {a: [1, b]}
+  other: value
+trailing:
+  terraform_outputs: {ignored_username: nested}
+"""
+
+
+class TestExtractOutputs(TestCase):
+    def test_only_wanted_outputs(self):
+        outputs = yaml_loader.extract_outputs(STATE, lambda key: "username" in key)
+        self.assertEqual(outputs, {
+            "cg_username": "cg-user",
+            "count_username": 12,
+            "quoted_username": "12",
+            "flag_username": True,
+            "nested_username": {"a": [1, "b"]},
+        })
+
+    def test_matches_full_parse(self):
+        everything = yaml_loader.extract_outputs(STATE, lambda key: True)
+        self.assertEqual(everything, yaml_loader.safe_load(STATE)["terraform_outputs"])
+
+    def test_no_outputs(self):
+        self.assertEqual(yaml_loader.extract_outputs("a: 1\n", lambda key: True), {})
@@ -1,10 +1,30 @@
 from dataclasses import dataclass
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class Threshold:
+    """
+    The thresholds of an account type, or of a known user when user is set. Records
+    are immutable so one can be shared by every lookup that matches it.
+    """
     account_type: str
     is_wildcard: bool
     warn: int
     violation: int
     alert: bool
     user: str = ""
+
+
+# Returned for every credential report user that isn't known
+UNKNOWN_USER = Threshold(account_type="", is_wildcard=False, warn=0, violation=0, alert=False)
+
+
+def policy_table(thresholds: list[Threshold]) -> dict[str, Threshold]:
+    """
+    The thresholds keyed by account type. When an account type is listed more than
+    once the first entry wins, the same as searching the list in order.
+    """
+    table: dict[str, Threshold] = {}
+    for threshold in thresholds:
+        table.setdefault(threshold.account_type, threshold)
+    return table
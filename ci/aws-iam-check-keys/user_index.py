@@ -0,0 +1,91 @@
+from threshold import Threshold
+
+
+class UserIndex:
+    """
+    Lookup table for matching credential report users against the known users.
+    Users that are not wildcards have to match the report user exactly, wildcard
+    users match anywhere inside the report user name. Wildcards are matched with
+    an Aho-Corasick automaton so each report row is scanned once no matter how
+    many users are known. When several users match, the first one in the list
+    the index was built from wins, the same as a linear scan would.
+    """
+
+    def __init__(self, users: list[Threshold]):
+        self._users: list[Threshold] = []
+        self._exact: dict[str, int] = {}
+        # Aho-Corasick automaton, one entry per state in each list
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._first: list[int] = []
+        self._wildcard_ends: list[tuple[int, int]] = []
+
+        for user in users:
+            # Users without a threshold for their account type are never matched
+            if user is None:
+                continue
+            position = len(self._users)
+            self._users.append(user)
+            if user.is_wildcard:
+                self._add_wildcard(user.user, position)
+            else:
+                self._exact.setdefault(user.user, position)
+
+        self._no_match = len(self._users)
+        self._first = [self._no_match] * len(self._goto)
+        for state, position in self._wildcard_ends:
+            self._first[state] = min(self._first[state], position)
+        self._build_fail_links()
+
+    def _add_wildcard(self, pattern: str, position: int):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._goto[state][char] = next_state
+            state = next_state
+        self._wildcard_ends.append((state, position))
+
+    def _build_fail_links(self):
+        """
+        Breadth first walk of the trie so every state links to the longest proper
+        suffix that is also in the trie, and inherits the first match of that suffix
+        """
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._first[next_state] = min(
+                    self._first[next_state], self._first[self._fail[next_state]]
+                )
+                queue.append(next_state)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def match(self, report_user: str) -> Threshold | None:
+        """
+        Return the known user matching the report user, or None if there isn't one
+        """
+        goto = self._goto
+        fail = self._fail
+        first = self._first
+
+        best = min(self._exact.get(report_user, self._no_match), first[0])
+        state = 0
+        for char in report_user:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if first[state] < best:
+                best = first[state]
+
+        if best == self._no_match:
+            return None
+        return self._users[best]
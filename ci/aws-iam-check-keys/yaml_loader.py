@@ -0,0 +1,170 @@
+import hashlib
+import os
+import pickle
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import yaml
+from yaml.constructor import SafeConstructor
+from yaml.nodes import ScalarNode
+from yaml.resolver import Resolver
+
+from atomic_file import atomic_write
+
+# The C loader is much faster on the large terraform state files, use it when
+# PyYAML was built with libyaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# Bump this when the structures being cached change shape
+CACHE_VERSION = b"1"
+# Cache entries that haven't been used for this many seconds are removed
+CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def safe_load(content: bytes | str) -> Any:
+    return yaml.load(content, Loader=SafeLoader)
+
+
+def _identity(document: Any) -> Any:
+    return document
+
+
+_resolver = Resolver()
+_constructor = SafeConstructor()
+
+
+def _scalar(event: yaml.ScalarEvent) -> Any:
+    tag = event.tag
+    if tag is None or tag == "!":
+        tag = _resolver.resolve(ScalarNode, event.value, event.implicit)
+    return _constructor.construct_object(ScalarNode(tag, event.value, style=event.style))
+
+
+def _compose(event: yaml.Event, events) -> Any:
+    """
+    Build the value that starts with event, consuming the rest of it from events
+    """
+    if isinstance(event, yaml.ScalarEvent):
+        return _scalar(event)
+    if isinstance(event, yaml.SequenceStartEvent):
+        items = []
+        for item in events:
+            if isinstance(item, yaml.SequenceEndEvent):
+                return items
+            items.append(_compose(item, events))
+    if isinstance(event, yaml.MappingStartEvent):
+        mapping = {}
+        for key in events:
+            if isinstance(key, yaml.MappingEndEvent):
+                return mapping
+            mapping[_compose(key, events)] = _compose(next(events), events)
+    raise yaml.YAMLError(f"unsupported yaml event {event}")
+
+
+def _skip(event: yaml.Event, events):
+    """
+    Consume the value that starts with event without building it
+    """
+    depth = 1 if isinstance(event, yaml.CollectionStartEvent) else 0
+    while depth:
+        event = next(events)
+        if isinstance(event, yaml.CollectionStartEvent):
+            depth += 1
+        elif isinstance(event, yaml.CollectionEndEvent):
+            depth -= 1
+
+
+def extract_outputs(stream, wanted: Callable[[str], bool]) -> dict[str, Any]:
+    """
+    Return the terraform_outputs entries of a terraform state document whose key
+    passes wanted. The document is read as a stream of yaml events, and everything
+    else is skipped over without being built.
+    """
+    events = yaml.parse(stream, Loader=SafeLoader)
+    outputs: dict[str, Any] = {}
+    depth = 0
+    for event in events:
+        if isinstance(event, yaml.CollectionStartEvent):
+            depth += 1
+            continue
+        if depth != 1 or not isinstance(event, yaml.ScalarEvent):
+            continue
+        # A key of the top level mapping, only terraform_outputs is looked inside
+        value = next(events)
+        if event.value != "terraform_outputs" or not isinstance(value, yaml.MappingStartEvent):
+            _skip(value, events)
+            continue
+        for key in events:
+            if isinstance(key, yaml.MappingEndEvent):
+                break
+            value = next(events)
+            if isinstance(key, yaml.ScalarEvent) and wanted(key.value):
+                outputs[key.value] = _compose(value, events)
+            else:
+                _skip(value, events)
+    return outputs
+
+
+class YamlCache:
+    """
+    Loads yaml files and keeps a pickle of what was extracted from them in cache_dir,
+    keyed by a hash of the file content and the extract function. An unchanged file is
+    not parsed again. Without a cache_dir every load parses the file.
+    """
+
+    def __init__(self, cache_dir: Path | str | None = None):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+
+    def load(
+        self,
+        filename: Path | str,
+        extract: Callable[[Any], Any] = _identity,
+        streaming: bool = False,
+    ) -> Any:
+        """
+        Return extract(document) for the yaml document in filename. With streaming,
+        extract is given the raw file content to parse itself, e.g. with extract_outputs.
+        """
+        content = Path(filename).read_bytes()
+        if self.cache_dir is None:
+            return self._extract(content, extract, streaming)
+
+        digest = hashlib.sha256(CACHE_VERSION)
+        digest.update(f"{extract.__module__}.{extract.__qualname__}".encode())
+        digest.update(content)
+        cache_file = self.cache_dir / f"{digest.hexdigest()}.pickle"
+        try:
+            with cache_file.open("rb") as f:
+                value = pickle.load(f)
+            os.utime(cache_file)
+            return value
+        except Exception:
+            # Missing or unreadable entry, parse the file again
+            pass
+
+        value = self._extract(content, extract, streaming)
+        self._save(cache_file, value)
+        return value
+
+    @staticmethod
+    def _extract(content: bytes, extract: Callable[[Any], Any], streaming: bool) -> Any:
+        return extract(content if streaming else safe_load(content))
+
+    def _save(self, cache_file: Path, value: Any):
+        # Written through a temporary file, so a partial pickle is never loaded
+        with atomic_write(cache_file, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._prune()
+
+    def _prune(self):
+        expired = time.time() - CACHE_MAX_AGE
+        for entry in self.cache_dir.glob("*.pickle"):
+            try:
+                if entry.stat().st_mtime < expired:
+                    entry.unlink()
+            except OSError:
+                pass
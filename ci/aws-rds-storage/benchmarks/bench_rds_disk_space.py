@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Benchmark for rds_disk_space against a simulated fleet. Fake RDS and CloudWatch
+clients page through describe_db_instances, answer metric queries (with some
+instances missing datapoints and some calls throttled) and count every call, so
+runtime, API call counts and payload size can be compared across fleet sizes.
+
+    python benchmarks/bench_rds_disk_space.py --fleet 10 100 1000 10000
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import rds_disk_space  # noqa: E402
+
+GIB = 1000000000.0
+
+
+class FakeAWS:
+    # Shared call counts and settings for the fake clients
+
+    def __init__(self, fleet, latency, throttle_rate, empty_rate):
+        self.instances = [
+            {
+                'DBInstanceIdentifier': 'cg-aws-broker-prod-' + str(number),
+                'AllocatedStorage': random.choice([20, 50, 100, 500]),
+                'DBInstanceStatus': 'available',
+            }
+            for number in range(fleet)
+        ]
+        empty = set(random.sample(range(fleet), int(fleet * empty_rate)))
+        self.free = {
+            db_instance['DBInstanceIdentifier']: None if number in empty
+            else db_instance['AllocatedStorage'] * GIB * random.random()
+            for number, db_instance in enumerate(self.instances)
+        }
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def call(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+        time.sleep(self.latency)
+
+
+class FakeRDS:
+    page_size = 100
+
+    def __init__(self, aws):
+        self.aws = aws
+
+    def describe_db_instances(self, Marker='0'):
+        self.aws.call('DescribeDBInstances')
+        start = int(Marker)
+        response = {'DBInstances': self.aws.instances[start:start + self.page_size]}
+        if start + self.page_size < len(self.aws.instances):
+            response['Marker'] = str(start + self.page_size)
+        return response
+
+
+class FakeMetricDataPaginator:
+    def __init__(self, aws):
+        self.aws = aws
+
+    def paginate(self, MetricDataQueries, StartTime, EndTime):
+        self.aws.call('GetMetricData')
+        # One datapoint a minute over the whole window, newest first, slowly filling up
+        timestamps = [EndTime - datetime.timedelta(minutes=age)
+                      for age in range(int((EndTime - StartTime).total_seconds() // 60))]
+        results = []
+        for query in MetricDataQueries:
+            db_instance = query['MetricStat']['Metric']['Dimensions'][0]['Value']
+            free = self.aws.free[db_instance]
+            results.append({
+                'Id': query['Id'],
+                'Timestamps': [] if free is None else timestamps,
+                'Values': [] if free is None else [free * (1 + 0.0001 * age) for age in range(len(timestamps))],
+            })
+        return [{'MetricDataResults': results}]
+
+
+class FakeCloudWatch:
+    def __init__(self, aws):
+        self.aws = aws
+
+    def get_paginator(self, operation):
+        return FakeMetricDataPaginator(self.aws)
+
+    def get_metric_statistics(self, Dimensions, **kwargs):
+        self.aws.call('GetMetricStatistics')
+        if random.random() < self.aws.throttle_rate:
+            raise ClientError({'Error': {'Code': 'Throttling'}}, 'GetMetricStatistics')
+        free = self.aws.free[Dimensions[0]['Value']]
+        return {'Datapoints': [] if free is None else [{'Average': free}]}
+
+
+def run(fleet, api, args):
+    aws = FakeAWS(fleet, args.latency / 1000.0, args.throttle_rate, args.empty_rate)
+    rds_client = FakeRDS(aws)
+    cw_client = FakeCloudWatch(aws)
+    with patch.dict('os.environ', {'RDS_FREE_SPACE_API': api}), \
+            patch('sys.stdout', open(os.devnull, 'w')):
+        # Always list the simulated fleet rather than a real inventory cache
+        os.environ.pop('RDS_INVENTORY_CACHE', None)
+        started = time.perf_counter()
+        db_to_storage = rds_disk_space.db_to_storage_map(rds_client)
+        inventory_done = time.perf_counter()
+        writer = rds_disk_space.get_prometheus_metrics(db_to_storage, cw_client=cw_client)
+        payload = writer.getvalue()
+        finished = time.perf_counter()
+    return {
+        'inventory': inventory_done - started,
+        'metrics': finished - inventory_done,
+        'calls': sum(aws.calls.values()),
+        'bytes': len(payload),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark rds_disk_space')
+    parser.add_argument('--fleet', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                        help='fleet sizes to simulate')
+    parser.add_argument('--api', nargs='+', default=['get_metric_data', 'get_metric_statistics'],
+                        help='RDS_FREE_SPACE_API values to compare')
+    parser.add_argument('--latency', type=float, default=5, help='simulated milliseconds per API call')
+    parser.add_argument('--throttle-rate', type=float, default=0.01,
+                        help='fraction of per-instance calls that are throttled')
+    parser.add_argument('--empty-rate', type=float, default=0.02,
+                        help='fraction of instances without datapoints')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    print('{:>6} {:>22} {:>10} {:>10} {:>7} {:>9}'.format(
+        'fleet', 'api', 'inventory', 'metrics', 'calls', 'bytes'))
+    for fleet in args.fleet:
+        for api in args.api:
+            result = run(fleet, api, args)
+            print('{:>6} {:>22} {:>10.3f} {:>10.3f} {:>7} {:>9}'.format(
+                fleet, api, result['inventory'], result['metrics'], result['calls'], result['bytes']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import rds_disk_space
+from targets import DEFAULT_TARGET
+
+
+class MetricsSnapshot:
+    """
+    The latest metrics payload for all targets, refreshed in the background. The list
+    of instances and their allocated storage is refreshed every inventory_interval
+    seconds, the free space every metrics_interval seconds. A target that fails keeps
+    being served with the last storage collected from it, with aws_rds_target_up 0.
+    """
+
+    def __init__(self, metrics_interval, inventory_interval, targets=(DEFAULT_TARGET,)):
+        self.metrics_interval = metrics_interval
+        self.inventory_interval = inventory_interval
+        self.targets = list(targets)
+        # target -> db_to_storage, a target missing here is listed on the next refresh
+        self.inventories = None
+        self.inventory_refreshed = 0.0
+        # target -> the last TargetStorage collected from it
+        self.storages = {}
+        self._lock = threading.Lock()
+        self._body = None
+        self._headers = None
+
+    def refresh(self, now=None):
+        now = time.monotonic() if now is None else now
+        list_all = self.inventories is None or now - self.inventory_refreshed >= self.inventory_interval
+        storages, failures = rds_disk_space.collect_targets(self.targets, None if list_all else self.inventories)
+        if list_all:
+            self.inventories = {}
+            self.inventory_refreshed = now
+        for target, storage in storages.items():
+            self.inventories[target] = storage.db_to_storage
+        self.storages.update(storages)
+        served = {target: self.storages[target] for target in self.targets if target in self.storages}
+        writer = rds_disk_space.render_metrics(served, failures)
+        body = writer.getvalue()
+        with self._lock:
+            self._body = body
+            self._headers = writer.headers()
+
+    def get(self):
+        # Returns (body, headers), or (None, None) before the first refresh finishes
+        with self._lock:
+            return self._body, self._headers
+
+    def run(self, stop):
+        # Keep refreshing until stop is set. A failed refresh keeps serving the last snapshot
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                self.refresh(started)
+            except Exception:
+                traceback.print_exc()
+            stop.wait(max(0.0, self.metrics_interval - (time.monotonic() - started)))
+
+
+def make_handler(snapshot):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body, headers = snapshot.get()
+            if body is None:
+                self.send_error(503, 'metrics not collected yet')
+                return
+            self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes are too frequent to be worth logging
+            pass
+
+    return MetricsHandler
+
+
+def serve(port, metrics_interval, inventory_interval, targets=(DEFAULT_TARGET,)):
+    # The series keep their instance="<db id>" label, so scrape with honor_labels: true
+    snapshot = MetricsSnapshot(metrics_interval, inventory_interval, targets)
+    stop = threading.Event()
+    refresher = threading.Thread(target=snapshot.run, args=(stop,), daemon=True)
+    refresher.start()
+    server = ThreadingHTTPServer(('', port), make_handler(snapshot))
+    print("Serving RDS storage metrics on port {}".format(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
@@ -0,0 +1,73 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+from botocore.exceptions import ClientError
+
+THROTTLING_CODES = (
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+)
+
+
+class RetryBudget:
+    """
+    A number of retries shared by every fetch in a run, so a throttled API gets
+    backed off from without retrying forever
+    """
+
+    def __init__(self, retries):
+        self.remaining = retries
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+def call_with_retries(fetch, budget, base_delay=0.5, max_delay=20.0, on_retry=None):
+    # Retries throttled calls with jittered exponential backoff while the budget lasts,
+    # any other error is raised straight away. on_retry(err) is called before each retry
+    attempt = 0
+    while True:
+        try:
+            return fetch()
+        except ClientError as err:
+            if err.response['Error']['Code'] not in THROTTLING_CODES or not budget.take():
+                raise
+            if on_retry:
+                on_retry(err)
+        delay = min(max_delay, base_delay * 2 ** attempt)
+        time.sleep(delay / 2 + random.uniform(0, delay / 2))
+        attempt += 1
+
+
+def fetch_all(keys, fetch, max_workers, retries, on_retry=None):
+    """
+    Call fetch(key) for every key on a pool of max_workers threads. Returns a map of
+    key -> result for the calls that worked and a map of key -> exception for the
+    ones that didn't.
+    """
+    budget = RetryBudget(retries)
+    results = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(call_with_retries, partial(fetch, key), budget, on_retry=on_retry): key
+            for key in keys
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as err:
+                errors[key] = err
+    return results, errors
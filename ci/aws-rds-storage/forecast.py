@@ -0,0 +1,45 @@
+import numpy as np
+
+# Fewer datapoints than this don't say much about a trend
+MIN_DATAPOINTS = 10
+
+
+def seconds_to_full(series, min_datapoints=MIN_DATAPOINTS):
+    """
+    Fit a least squares line through the free space history of every instance at once
+    and project when it reaches zero. series maps DBInstanceIdentifier -> (timestamps
+    in epoch seconds, free bytes). Returns DBInstanceIdentifier -> seconds from the
+    latest datapoint until the disk is full, +Inf for disks that aren't filling up.
+    Instances with fewer than min_datapoints datapoints are left out.
+    """
+    names = [db_instance for db_instance, (_, values) in series.items() if len(values) >= min_datapoints]
+    if not names:
+        return {}
+
+    # One row per instance, padded with NaN up to the longest history
+    width = max(len(series[db_instance][1]) for db_instance in names)
+    times = np.full((len(names), width), np.nan)
+    free = np.full((len(names), width), np.nan)
+    for row, db_instance in enumerate(names):
+        timestamps, values = series[db_instance]
+        times[row, :len(timestamps)] = timestamps
+        free[row, :len(values)] = values
+
+    present = ~np.isnan(free)
+    counts = present.sum(axis=1)
+    time_offsets = np.where(present, times - (np.nansum(times, axis=1) / counts)[:, None], 0.0)
+    free_offsets = np.where(present, free - (np.nansum(free, axis=1) / counts)[:, None], 0.0)
+    spread = (time_offsets * time_offsets).sum(axis=1)
+    latest = free[np.arange(len(names)), np.nanargmax(times, axis=1)]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Bytes per second, negative while the disk is filling up
+        slope = (time_offsets * free_offsets).sum(axis=1) / spread
+        projection = np.where(slope < 0, latest / -slope, np.inf)
+
+    # Histories with a single distinct timestamp have no slope
+    return {
+        db_instance: seconds
+        for db_instance, seconds, fitted in zip(names, projection.tolist(), (spread > 0).tolist())
+        if fitted
+    }
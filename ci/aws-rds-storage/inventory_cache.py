@@ -0,0 +1,86 @@
+import hashlib
+import json
+import time
+
+from botocore.exceptions import ClientError
+
+from atomic_file import load_json, save_json
+
+# Instances in these states aren't expected to change storage between full listings
+SETTLED_STATUSES = ('available', 'stopped')
+# Above this many unsettled instances a full listing is cheaper than describing each one
+MAX_INDIVIDUAL_REFRESHES = 20
+
+
+def fingerprint(db_instance):
+    fields = [db_instance['AllocatedStorage'], db_instance.get('DBInstanceStatus', '')]
+    return hashlib.sha256(json.dumps(fields).encode('utf-8')).hexdigest()[:16]
+
+
+def compact(db_instance):
+    return {
+        'DBInstanceIdentifier': db_instance['DBInstanceIdentifier'],
+        'AllocatedStorage': db_instance['AllocatedStorage'],
+        'DBInstanceStatus': db_instance.get('DBInstanceStatus', ''),
+        'Fingerprint': fingerprint(db_instance),
+    }
+
+
+class InventoryCache:
+    """
+    On-disk cache of the RDS instance list, keyed by DBInstanceIdentifier. The full
+    list is only fetched with describe_db_instances when the cache is older than ttl
+    seconds. In between, only the instances that were in the middle of a change
+    (creating, modifying, ...) are described again.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+
+    def load(self):
+        return load_json(self.path)
+
+    def save(self, cache):
+        save_json(self.path, cache)
+
+    def instances(self, rds_client, list_instances, now=None):
+        # list_instances(rds_client) does the full listing
+        now = time.time() if now is None else now
+        cache = self.load()
+        if cache is None or now - cache['listed_at'] >= self.ttl:
+            return self._full_refresh(rds_client, list_instances, now)
+
+        instances = cache['instances']
+        unsettled = [
+            identifier for identifier, db_instance in instances.items()
+            if db_instance['DBInstanceStatus'] not in SETTLED_STATUSES
+        ]
+        if len(unsettled) > MAX_INDIVIDUAL_REFRESHES:
+            return self._full_refresh(rds_client, list_instances, now)
+
+        changed = False
+        for identifier in unsettled:
+            try:
+                response = rds_client.describe_db_instances(DBInstanceIdentifier=identifier)
+            except ClientError as err:
+                if err.response['Error']['Code'] != 'DBInstanceNotFound':
+                    raise
+                del instances[identifier]
+                changed = True
+                continue
+            refreshed = compact(response['DBInstances'][0])
+            if refreshed['Fingerprint'] != instances[identifier]['Fingerprint']:
+                instances[identifier] = refreshed
+                changed = True
+        if changed:
+            self.save(cache)
+        return list(instances.values())
+
+    def _full_refresh(self, rds_client, list_instances, now):
+        instances = {
+            db_instance['DBInstanceIdentifier']: compact(db_instance)
+            for db_instance in list_instances(rds_client)
+        }
+        self.save({'listed_at': now, 'instances': instances})
+        return list(instances.values())
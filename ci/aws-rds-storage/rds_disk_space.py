@@ -1,14 +1,68 @@
 #!/usr/bin/env python
+import argparse
 import boto3
 import datetime
-import requests
 import os
 import sys
+import threading
+from functools import partial
+from pathlib import Path
+from typing import NamedTuple
 
-rds_client = boto3.client('rds')
-cw_client = boto3.client('cloudwatch')
+from botocore.config import Config
 
-def get_db_instances():
+# Modules shared with the other collectors live in ci/common
+sys.path.append(str(Path(__file__).resolve().parent.parent / "common"))
+
+from exposition import ExpositionWriter
+from fetch_engine import fetch_all
+from forecast import seconds_to_full
+from inventory_cache import InventoryCache
+from job_metrics import JobMetrics
+from push_ledger import PushLedger
+from pushgateway import group_path
+from sinks import sink_from_env
+from targets import DEFAULT_TARGET, load_targets
+
+# boto3 clients are created on first use and reused afterwards, one per service and target
+_clients = {}
+_sessions = {}
+# boto3 sessions aren't thread safe, so clients are created one at a time
+_clients_lock = threading.Lock()
+# How the job itself performs, pushed to its own group after the storage metrics
+job_metrics = JobMetrics('aws_rds_storage_check')
+
+# GetMetricData accepts at most 500 metric queries per request
+MAX_METRIC_QUERIES = 500
+FETCH_WORKERS = int(os.getenv("RDS_FETCH_WORKERS", "10"))
+# The current free space is the lowest value over the last 5 minutes
+FREE_SPACE_WINDOW = datetime.timedelta(minutes=5)
+
+
+class TargetStorage(NamedTuple):
+    # What was collected for one target
+    db_to_storage: dict
+    free_space: dict
+    errors: dict
+    seconds_to_full: dict = {}
+
+
+def get_client(service, target=DEFAULT_TARGET):
+    with _clients_lock:
+        if (service, target) not in _clients:
+            if target not in _sessions:
+                _sessions[target] = boto3.Session(**target.session_args())
+            # Adaptive retries rate limit the client itself when AWS starts throttling,
+            # which matters when many threads share it
+            config = Config(
+                retries={'mode': 'adaptive', 'max_attempts': int(os.getenv("RDS_MAX_ATTEMPTS", "5"))},
+                max_pool_connections=FETCH_WORKERS,
+            )
+            _clients[(service, target)] = job_metrics.instrument(_sessions[target].client(service, config=config))
+        return _clients[(service, target)]
+
+def get_db_instances(rds_client=None):
+    rds_client = rds_client or get_client('rds')
     db_instances = []
     rds_response = rds_client.describe_db_instances()
     db_instances.extend(rds_response['DBInstances'])
@@ -17,15 +71,34 @@ def get_db_instances():
         db_instances.extend(rds_response['DBInstances'])
     return db_instances
 
-def db_to_storage_map():
+def inventory_cache_path(target=DEFAULT_TARGET):
+    # Every target other than the default gets its own cache file next to RDS_INVENTORY_CACHE
+    cache_path = os.getenv("RDS_INVENTORY_CACHE")
+    if not cache_path or target == DEFAULT_TARGET:
+        return cache_path
+    base, extension = os.path.splitext(cache_path)
+    return '{}-{}-{}{}'.format(base, target.account, target.region, extension)
+
+def list_db_instances(rds_client=None, target=DEFAULT_TARGET):
+    # Use the on-disk inventory cache when one is configured
+    cache_path = inventory_cache_path(target)
+    if not cache_path:
+        return get_db_instances(rds_client or get_client('rds', target))
+    cache = InventoryCache(cache_path, ttl=float(os.getenv("RDS_INVENTORY_TTL", "3600")))
+    return cache.instances(rds_client or get_client('rds', target), get_db_instances)
+
+def db_to_storage_map(rds_client=None, target=DEFAULT_TARGET):
     # Create a map of DBInstanceIdentifier -> AllocatedStorage
     # These metrics are by default only collected in bytes, need to convert to GB
     db_to_storage = {}
-    for db_instance in get_db_instances():
+    for db_instance in list_db_instances(rds_client, target):
         db_to_storage[db_instance["DBInstanceIdentifier"]] = db_instance["AllocatedStorage"] * 1000000000.0
     return db_to_storage
 
-def get_free_space(db_instance):
+def get_free_space(db_instance, cw_client=None):
+    # Returns None when there are no datapoints yet, probably a new born db.
+    # API errors are raised rather than hidden behind a made up value
+    cw_client = cw_client or get_client('cloudwatch')
     cloudtrail_response = cw_client.get_metric_statistics(Namespace='AWS/RDS', MetricName='FreeStorageSpace',
         Dimensions=[
             {
@@ -38,34 +111,234 @@ def get_free_space(db_instance):
         Period=60,
         Statistics=['Average'],)
 
-    try:
-        free_space = min([(lambda x: x['Average'])(datapoint) for datapoint in cloudtrail_response['Datapoints']])
-    except:
-        # Probably a new born db, could not pull cloudwatch metrics, setting value to 10000000000 (10GB) as minimum size is 20GB
-        free_space = 10000000000
-        
+    datapoints = cloudtrail_response['Datapoints']
+    if not datapoints:
+        return None
+    return min(datapoint['Average'] for datapoint in datapoints)
+
+def get_free_space_each(db_instances, cw_client=None):
+    # Fetch the free space of each instance separately, on a thread pool.
+    # Returns the map of DBInstanceIdentifier -> FreeStorageSpace and a map of
+    # DBInstanceIdentifier -> error for the instances that could not be fetched
+    cw_client = cw_client or get_client('cloudwatch')
+    return fetch_all(
+        db_instances,
+        partial(get_free_space, cw_client=cw_client),
+        max_workers=FETCH_WORKERS,
+        retries=int(os.getenv("RDS_RETRY_BUDGET", "50")),
+        on_retry=lambda err: job_metrics.record_retry('GetMetricStatistics'),
+    )
+
+def free_space_query(query_id, db_instance):
+    return {
+        'Id': query_id,
+        'MetricStat': {
+            'Metric': {
+                'Namespace': 'AWS/RDS',
+                'MetricName': 'FreeStorageSpace',
+                'Dimensions': [
+                    {
+                        'Name': 'DBInstanceIdentifier',
+                        'Value': db_instance
+                    },
+                ],
+            },
+            'Period': 60,
+            'Stat': 'Average',
+        },
+        'ReturnData': True,
+    }
+
+def get_free_space_series(db_instances, window, cw_client=None, end_time=None):
+    # Create a map of DBInstanceIdentifier -> (timestamps, FreeStorageSpace values) over the
+    # last window, fetching the metrics for up to MAX_METRIC_QUERIES instances per
+    # GetMetricData request. Timestamps are in epoch seconds
+    cw_client = cw_client or get_client('cloudwatch')
+    end_time = end_time or datetime.datetime.now(datetime.timezone.utc)
+    start_time = end_time - window
+    paginator = cw_client.get_paginator('get_metric_data')
+    series = {db_instance: ([], []) for db_instance in db_instances}
+    for offset in range(0, len(db_instances), MAX_METRIC_QUERIES):
+        batch = db_instances[offset:offset + MAX_METRIC_QUERIES]
+        # Query ids have to start with a lowercase letter, so map them back by position
+        queries = [free_space_query('db' + str(position), db_instance) for position, db_instance in enumerate(batch)]
+        for page in paginator.paginate(MetricDataQueries=queries, StartTime=start_time, EndTime=end_time):
+            for result in page['MetricDataResults']:
+                timestamps, values = series[batch[int(result['Id'][2:])]]
+                timestamps.extend(timestamp.timestamp() for timestamp in result['Timestamps'])
+                values.extend(result['Values'])
+    return series
+
+def latest_free_space(series, since):
+    # The lowest value of each series at or after since, in epoch seconds.
+    # Instances without datapoints, probably new born dbs, are None
+    free_space = {}
+    for db_instance, (timestamps, values) in series.items():
+        recent = [value for timestamp, value in zip(timestamps, values) if timestamp >= since]
+        free_space[db_instance] = min(recent) if recent else None
     return free_space
 
-def get_prometheus_metrics(db_to_storage):
-    results = ""
-    for db_instance in db_to_storage:
-        results += 'aws_rds_disk_allocated{instance="' + db_instance + '"} ' + str(db_to_storage[db_instance]) + '\n'
-        results += 'aws_rds_disk_free{instance="' + db_instance + '"} ' + str(get_free_space(db_instance)) + '\n'
-    return results
+def get_free_space_map(db_instances, cw_client=None):
+    # Create a map of DBInstanceIdentifier -> FreeStorageSpace
+    end_time = datetime.datetime.now(datetime.timezone.utc)
+    series = get_free_space_series(db_instances, FREE_SPACE_WINDOW, cw_client, end_time)
+    return latest_free_space(series, (end_time - FREE_SPACE_WINDOW).timestamp())
+
+def fetch_free_space(db_instances, cw_client=None, target=DEFAULT_TARGET):
+    # Returns the map of DBInstanceIdentifier -> FreeStorageSpace, the map of
+    # DBInstanceIdentifier -> error for instances whose fetch failed, and the map of
+    # DBInstanceIdentifier -> projected seconds until the disk is full
+    cw_client = cw_client or get_client('cloudwatch', target)
+    errors = {}
+    projections = {}
+    with job_metrics.stage('free_space'):
+        if os.getenv("RDS_FREE_SPACE_API", "get_metric_data") == "get_metric_statistics":
+            free_space, errors = get_free_space_each(db_instances, cw_client)
+            for db_instance, err in errors.items():
+                print("Could not get free space for {}: {}".format(db_instance, err))
+            return free_space, errors, projections
+
+        # The forecast comes from the same request, just over a longer window
+        forecast_window = datetime.timedelta(seconds=float(os.getenv("RDS_FORECAST_WINDOW", "10800")))
+        end_time = datetime.datetime.now(datetime.timezone.utc)
+        series = get_free_space_series(db_instances, max(forecast_window, FREE_SPACE_WINDOW), cw_client, end_time)
+        free_space = latest_free_space(series, (end_time - FREE_SPACE_WINDOW).timestamp())
+    if forecast_window > FREE_SPACE_WINDOW:
+        with job_metrics.stage('forecast'):
+            projections = seconds_to_full(series)
+    return free_space, errors, projections
+
+def collect_target(target, db_to_storage=None):
+    # Lists the target's instances unless db_to_storage is given, then fetches their free space
+    if db_to_storage is None:
+        with job_metrics.stage('inventory'):
+            db_to_storage = db_to_storage_map(target=target)
+    free_space, errors, projections = fetch_free_space(list(db_to_storage), target=target)
+    return TargetStorage(db_to_storage, free_space, errors, projections)
+
+def collect_targets(targets, inventories=None):
+    # Collect every target at the same time, with per target clients. Returns the map of
+    # target -> TargetStorage and the map of target -> error for the targets that failed
+    inventories = inventories or {}
+    storages, failures = fetch_all(
+        targets,
+        lambda target: collect_target(target, inventories.get(target)),
+        max_workers=max(1, len(targets)),
+        retries=0,
+    )
+    for target, err in failures.items():
+        print("Could not collect {} {}: {!r}".format(target.account, target.region, err))
+    return storages, failures
+
+def render_metrics(storages, failures=None, compress=False):
+    # Returns an ExpositionWriter holding the finished payload for all targets.
+    # Instances with no free space datapoints, or whose fetch failed, get no aws_rds_disk_free sample.
+    # Passing the failures from collect_targets adds aws_rds_target_up for every target
+    with job_metrics.stage('render'):
+        writer = ExpositionWriter(compress=compress)
+        writer.write_family('aws_rds_disk_allocated', 'Allocated storage of the RDS instance in bytes', 'gauge',
+            (({'instance': db_instance, **target.labels()}, allocated)
+             for target, storage in storages.items()
+             for db_instance, allocated in storage.db_to_storage.items()))
+        writer.write_family('aws_rds_disk_free', 'Free storage space of the RDS instance in bytes', 'gauge',
+            (({'instance': db_instance, **target.labels()}, storage.free_space[db_instance])
+             for target, storage in storages.items()
+             for db_instance in storage.db_to_storage if storage.free_space.get(db_instance) is not None))
+        if any(storage.seconds_to_full for storage in storages.values()):
+            writer.write_family('aws_rds_disk_seconds_to_full', 'Projected seconds until the RDS instance runs out of storage, +Inf if it is not filling up', 'gauge',
+                (({'instance': db_instance, **target.labels()}, seconds)
+                 for target, storage in storages.items()
+                 for db_instance, seconds in storage.seconds_to_full.items()))
+        writer.write_family('aws_rds_disk_free_fetch_errors', 'RDS instances whose free storage space could not be fetched', 'gauge',
+            ((target.labels(), len(storage.errors)) for target, storage in storages.items()))
+        if failures is not None:
+            write_target_up(writer, storages, failures)
+    return writer
+
+def write_target_up(writer, storages, failures):
+    # A failed target can still have storage from an earlier run, it's down all the same
+    up = {target: 1 for target in storages}
+    up.update({target: 0 for target in failures})
+    writer.write_family('aws_rds_target_up', 'Whether RDS storage could be collected from the account and region', 'gauge',
+        [(target.labels(), value) for target, value in up.items()])
+
+def target_group(target):
+    # Each target has its own group, the default target keeps the job's plain group
+    return group_path('aws_rds_storage_check', {label: value for label, value in target.labels().items() if value})
+
+# aws_rds_target_up for every target, kept apart from the targets' own groups
+TARGETS_GROUP = group_path('aws_rds_storage_check', {'instance': 'targets'})
+
+def push_targets(sink, ledger, targets, storages, failures, compress=False):
+    """
+    Send each collected target to its own group, only when it changed since the last
+    push, and aws_rds_target_up for all of them to TARGETS_GROUP. A failed target isn't
+    sent, so its group keeps the last storage that could be collected and its alerts
+    keep firing. Groups of targets that are no longer listed are deleted first, so
+    their series never clash with the ones being pushed.
+    """
+    current_groups = {target_group(target) for target in targets} | {TARGETS_GROUP, job_metrics.group()}
+    with job_metrics.stage('push'):
+        for vanished in ledger.delete_vanished(sink, 'aws_rds_storage_check', current_groups):
+            print("Deleted {} group {}".format(sink.name, vanished))
+
+    outputs = {target_group(target): render_metrics({target: storage}, compress=compress)
+               for target, storage in storages.items()}
+    with job_metrics.stage('render'):
+        status = ExpositionWriter(compress=compress)
+        write_target_up(status, storages, failures)
+    outputs[TARGETS_GROUP] = status
+    with job_metrics.stage('push'):
+        for group, output in outputs.items():
+            if not ledger.needs_push(group, output.digest()):
+                print("Metrics of {} unchanged since the last push".format(group))
+                continue
+            job_metrics.record_payload(sink.name, output.bytes_written)
+            sink.send(group, output.getvalue(), output.headers())
+            ledger.record(group, output.digest())
+
+def get_prometheus_metrics(db_to_storage, compress=False, cw_client=None, target=DEFAULT_TARGET):
+    # Returns an ExpositionWriter holding the finished payload for a single target
+    free_space, errors, projections = fetch_free_space(list(db_to_storage), cw_client, target)
+    return render_metrics({target: TargetStorage(db_to_storage, free_space, errors, projections)}, compress=compress)
 
 
 if __name__ == "__main__":
-    if not ("GATEWAY_HOST") in os.environ:
-        print("GATEWAY_HOST is required.")
+    parser = argparse.ArgumentParser(description="Report free and allocated storage for RDS instances")
+    parser.add_argument(
+        "--serve", action="store_true", help="run as an exporter serving /metrics instead of pushing once"
+    )
+    args = parser.parse_args()
+    if args.serve:
+        from exporter import serve
+        serve(
+            port=int(os.getenv("EXPORTER_PORT", "9701")),
+            metrics_interval=float(os.getenv("RDS_METRICS_INTERVAL", "60")),
+            inventory_interval=float(os.getenv("RDS_INVENTORY_INTERVAL", "900")),
+            targets=load_targets(os.getenv("RDS_TARGETS_FILE")),
+        )
+        sys.exit(0)
+
+    try:
+        sink = sink_from_env()
+    except ValueError as err:
+        print(err)
         sys.exit(1)
 
-    output = get_prometheus_metrics(db_to_storage_map())
-    prometheus_url = os.getenv("GATEWAY_HOST") + ":" + os.getenv("GATEWAY_PORT", "9091") + "/metrics/job/aws_rds_storage_check"
+    targets = load_targets(os.getenv("RDS_TARGETS_FILE"))
+    storages, failures = collect_targets(targets)
+
+    # The storage metrics are only pushed when they changed since the last run
+    ledger = PushLedger(os.getenv("PUSH_LEDGER"), reconcile_interval=float(os.getenv("PUSH_RECONCILE_INTERVAL", "86400")),
+                        destination=sink.destination)
+    push_targets(sink, ledger, targets, storages, failures,
+                 compress=os.getenv("GATEWAY_GZIP", "false").lower() == "true")
+    ledger.save()
+    job_metrics.send(sink)
 
-    res = requests.put(url=prometheus_url,
-        data=output,
-        headers={'Content-Type': 'application/octet-stream'})
-    res.raise_for_status()
+    # The targets that could be collected were still pushed, but the job fails
+    if failures:
+        sys.exit(1)
 
 
 # TODO - future alerts can use rds_client to alert on:
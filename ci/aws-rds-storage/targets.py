@@ -0,0 +1,61 @@
+import os
+from typing import NamedTuple, Optional
+
+import yaml
+
+
+class Target(NamedTuple):
+    """
+    An account and region to collect RDS storage from. Credentials are either a named
+    profile or the names of the environment variables holding the keys, so the
+    targets file never has secrets in it. Without either, boto3's default credentials
+    are used.
+    """
+    account: str = ''
+    region: str = ''
+    profile: Optional[str] = None
+    aws_access_key_id_env: Optional[str] = None
+    aws_secret_access_key_env: Optional[str] = None
+
+    def session_args(self):
+        # Arguments for boto3.Session
+        args = {}
+        if self.region:
+            args['region_name'] = self.region
+        if self.profile:
+            args['profile_name'] = self.profile
+        if self.aws_access_key_id_env:
+            args['aws_access_key_id'] = os.environ[self.aws_access_key_id_env]
+            args['aws_secret_access_key'] = os.environ[self.aws_secret_access_key_env]
+        return args
+
+    def labels(self):
+        # Empty labels are left out of the output, so the default target adds none
+        return {'account': self.account, 'region': self.region}
+
+
+# The account and region boto3 is configured for, used when there is no targets file
+DEFAULT_TARGET = Target()
+
+
+def load_targets(path=None):
+    """
+    Read the targets from a yaml list like
+
+        - account: com
+          region: us-east-1
+        - account: gov
+          region: us-gov-west-1
+          aws_access_key_id_env: GOV_AWS_ACCESS_KEY_ID
+          aws_secret_access_key_env: GOV_AWS_SECRET_ACCESS_KEY
+
+    Without a path there is just the default target.
+    """
+    if not path:
+        return [DEFAULT_TARGET]
+    with open(path) as f:
+        entries = yaml.safe_load(f) or []
+    targets = [Target(**entry) for entry in entries]
+    if len(set(targets)) != len(targets):
+        raise ValueError('{} lists the same target more than once'.format(path))
+    return targets
@@ -0,0 +1,75 @@
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+from unittest import TestCase
+from unittest.mock import patch
+
+import exporter
+from targets import Target
+
+
+@patch('exporter.rds_disk_space.fetch_free_space', return_value=({'a': 0.5}, {}, {}))
+@patch('exporter.rds_disk_space.db_to_storage_map', return_value={'a': 1.0})
+class TestExporter(TestCase):
+    def test_inventory_refreshed_less_often(self, db_to_storage_map, fetch_free_space):
+        snapshot = exporter.MetricsSnapshot(metrics_interval=60, inventory_interval=600)
+
+        for now in [0, 60, 120, 600, 660]:
+            snapshot.refresh(now)
+
+        self.assertEqual(db_to_storage_map.call_count, 2)
+        self.assertEqual(fetch_free_space.call_count, 5)
+
+    def test_collects_every_target(self, db_to_storage_map, fetch_free_space):
+        targets = [Target('com', 'us-east-1'), Target('gov', 'us-gov-west-1')]
+        snapshot = exporter.MetricsSnapshot(metrics_interval=60, inventory_interval=600, targets=targets)
+
+        snapshot.refresh(0)
+        snapshot.refresh(60)
+
+        body, headers = snapshot.get()
+        self.assertIn(b'aws_rds_disk_allocated{instance="a",account="com",region="us-east-1"} 1.0\n', body)
+        self.assertIn(b'aws_rds_disk_free{instance="a",account="gov",region="us-gov-west-1"} 0.5\n', body)
+        self.assertEqual(db_to_storage_map.call_count, 2)
+        self.assertEqual(fetch_free_space.call_count, 4)
+
+    def test_failed_target_keeps_its_last_storage(self, db_to_storage_map, fetch_free_space):
+        targets = [Target('com', 'us-east-1'), Target('gov', 'us-gov-west-1')]
+        snapshot = exporter.MetricsSnapshot(metrics_interval=60, inventory_interval=600, targets=targets)
+        snapshot.refresh(0)
+
+        def fetch(db_instances, target):
+            if target == targets[1]:
+                raise RuntimeError('throttled')
+            return {'a': 0.25}, {}, {}
+
+        fetch_free_space.side_effect = fetch
+        snapshot.refresh(60)
+
+        body, headers = snapshot.get()
+        self.assertIn(b'aws_rds_disk_free{instance="a",account="com",region="us-east-1"} 0.25\n', body)
+        self.assertIn(b'aws_rds_disk_free{instance="a",account="gov",region="us-gov-west-1"} 0.5\n', body)
+        self.assertIn(b'aws_rds_target_up{account="gov",region="us-gov-west-1"} 0.0\n', body)
+        self.assertEqual(body.count(b'aws_rds_target_up{account="gov"'), 1)
+
+    def test_serves_snapshot(self, db_to_storage_map, fetch_free_space):
+        snapshot = exporter.MetricsSnapshot(metrics_interval=60, inventory_interval=600)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), exporter.make_handler(snapshot))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            with self.assertRaises(urllib.error.HTTPError) as raised:
+                urllib.request.urlopen(url + '/metrics')
+            self.assertEqual(raised.exception.code, 503)
+
+            snapshot.refresh(0)
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertIn(b'aws_rds_disk_allocated{instance="a"} 1.0', response.read())
+
+            with self.assertRaises(urllib.error.HTTPError) as raised:
+                urllib.request.urlopen(url + '/other')
+            self.assertEqual(raised.exception.code, 404)
+        finally:
+            server.shutdown()
+            server.server_close()
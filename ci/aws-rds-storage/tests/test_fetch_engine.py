@@ -0,0 +1,67 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError
+
+from fetch_engine import RetryBudget, call_with_retries, fetch_all
+
+
+def throttled():
+    return ClientError({'Error': {'Code': 'Throttling'}}, 'GetMetricStatistics')
+
+
+@patch('fetch_engine.time.sleep')
+class TestFetchEngine(TestCase):
+    def test_throttled_calls_are_retried(self, sleep):
+        responses = [throttled(), throttled(), 42]
+
+        def fetch():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        budget = RetryBudget(5)
+        self.assertEqual(call_with_retries(fetch, budget), 42)
+        self.assertEqual(budget.remaining, 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_on_retry_is_called_for_each_retry(self, sleep):
+        responses = [throttled(), throttled(), 42]
+
+        def fetch():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        retried = []
+        call_with_retries(fetch, RetryBudget(5), on_retry=retried.append)
+        self.assertEqual(len(retried), 2)
+
+    def test_retries_stop_when_budget_is_spent(self, sleep):
+        def fetch():
+            raise throttled()
+
+        with self.assertRaises(ClientError):
+            call_with_retries(fetch, RetryBudget(2))
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_other_errors_are_not_retried(self, sleep):
+        def fetch():
+            raise ClientError({'Error': {'Code': 'AccessDenied'}}, 'GetMetricStatistics')
+
+        with self.assertRaises(ClientError):
+            call_with_retries(fetch, RetryBudget(5))
+        sleep.assert_not_called()
+
+    def test_fetch_all_separates_errors(self, sleep):
+        def fetch(key):
+            if key == 'bad':
+                raise ValueError(key)
+            return key * 2
+
+        results, errors = fetch_all(['a', 'bad', 'c'], fetch, max_workers=2, retries=0)
+
+        self.assertEqual(results, {'a': 'aa', 'c': 'cc'})
+        self.assertEqual(list(errors), ['bad'])
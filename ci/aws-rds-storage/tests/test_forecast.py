@@ -0,0 +1,24 @@
+import math
+from unittest import TestCase
+
+from forecast import seconds_to_full
+
+
+class TestForecast(TestCase):
+    def test_histories_of_different_lengths(self):
+        series = {
+            # 10 bytes a second gone, 1000 left at the latest datapoint, out of order
+            'short': ([300.0, 0.0, 60.0, 240.0, 120.0, 180.0], [1000.0, 4000.0, 3400.0, 1600.0, 2800.0, 2200.0]),
+            'long': ([float(t) for t in range(0, 600, 60)], [500.0 + t for t in range(0, 600, 60)]),
+            'sparse': ([0.0, 60.0], [10.0, 5.0]),
+        }
+
+        projections = seconds_to_full(series, min_datapoints=5)
+
+        self.assertAlmostEqual(projections['short'], 100.0)
+        self.assertTrue(math.isinf(projections['long']))
+        self.assertNotIn('sparse', projections)
+
+    def test_no_slope_without_distinct_timestamps(self):
+        self.assertEqual(seconds_to_full({'a': ([60.0] * 3, [1.0, 2.0, 3.0])}, min_datapoints=3), {})
+        self.assertEqual(seconds_to_full({}), {})
@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from botocore.exceptions import ClientError
+
+from inventory_cache import InventoryCache
+
+
+def db_instance(identifier, allocated, status='available'):
+    return {
+        'DBInstanceIdentifier': identifier,
+        'AllocatedStorage': allocated,
+        'DBInstanceStatus': status,
+    }
+
+
+class TestInventoryCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = InventoryCache(os.path.join(self.directory.name, 'inventory.json'), ttl=3600)
+        self.rds_client = MagicMock()
+        self.list_instances = MagicMock(return_value=[
+            db_instance('a', 20),
+            db_instance('b', 50, 'modifying'),
+            db_instance('c', 20, 'creating'),
+        ])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def storage(self, instances):
+        return {i['DBInstanceIdentifier']: i['AllocatedStorage'] for i in instances}
+
+    def test_full_listing_when_missing_or_expired(self):
+        self.cache.instances(self.rds_client, self.list_instances, now=0)
+        self.cache.instances(self.rds_client, self.list_instances, now=3600)
+
+        self.assertEqual(self.list_instances.call_count, 2)
+        with open(self.cache.path) as f:
+            self.assertEqual(json.load(f)['listed_at'], 3600)
+
+    def test_only_unsettled_instances_refreshed(self):
+        self.cache.instances(self.rds_client, self.list_instances, now=0)
+        self.rds_client.describe_db_instances.side_effect = [
+            {'DBInstances': [db_instance('b', 100)]},
+            ClientError({'Error': {'Code': 'DBInstanceNotFound'}}, 'DescribeDBInstances'),
+        ]
+
+        instances = self.cache.instances(self.rds_client, self.list_instances, now=60)
+
+        self.assertEqual(self.list_instances.call_count, 1)
+        self.assertEqual(self.storage(instances), {'a': 20, 'b': 100})
+
+        # b has settled, so nothing needs describing any more
+        instances = self.cache.instances(self.rds_client, self.list_instances, now=120)
+        self.assertEqual(self.rds_client.describe_db_instances.call_count, 2)
+        self.assertEqual(self.storage(instances), {'a': 20, 'b': 100})
+
+    def test_corrupt_cache_is_relisted(self):
+        with open(self.cache.path, 'w') as f:
+            f.write('{not json')
+
+        instances = self.cache.instances(self.rds_client, self.list_instances, now=0)
+
+        self.assertEqual(self.storage(instances), {'a': 20, 'b': 50, 'c': 20})
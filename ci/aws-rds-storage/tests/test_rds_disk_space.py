@@ -0,0 +1,187 @@
+import datetime
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+import rds_disk_space
+from push_ledger import PushLedger
+from targets import DEFAULT_TARGET, Target, load_targets
+
+
+def paged_metric_data(values_by_instance):
+    # A CloudWatch client whose GetMetricData paginator returns the given values,
+    # newest first and a minute apart up to EndTime like CloudWatch does
+    def paginate(MetricDataQueries, StartTime, EndTime):
+        results = []
+        for query in MetricDataQueries:
+            values = values_by_instance.get(query['MetricStat']['Metric']['Dimensions'][0]['Value'], [])
+            results.append({
+                'Id': query['Id'],
+                'Timestamps': [EndTime - datetime.timedelta(minutes=age) for age in range(len(values))],
+                'Values': values,
+            })
+        return [{'MetricDataResults': results}]
+
+    cw_client = MagicMock()
+    cw_client.get_paginator.return_value.paginate.side_effect = paginate
+    return cw_client
+
+
+class TestRdsDiskSpace(TestCase):
+    def test_db_to_storage_map_pages_instances(self):
+        rds_client = MagicMock()
+        rds_client.describe_db_instances.side_effect = [
+            {'DBInstances': [{'DBInstanceIdentifier': 'a', 'AllocatedStorage': 20}], 'Marker': 'next'},
+            {'DBInstances': [{'DBInstanceIdentifier': 'b', 'AllocatedStorage': 100}]},
+        ]
+
+        self.assertEqual(
+            rds_disk_space.db_to_storage_map(rds_client),
+            {'a': 20000000000.0, 'b': 100000000000.0},
+        )
+
+    def test_get_free_space_map_batches_queries(self):
+        db_instances = ['db-' + str(number) for number in range(1200)]
+        cw_client = paged_metric_data({'db-0': [5.0, 3.0], 'db-1199': [7.0]})
+
+        free_space = rds_disk_space.get_free_space_map(db_instances, cw_client)
+
+        self.assertEqual(cw_client.get_paginator.return_value.paginate.call_count, 3)
+        self.assertEqual(free_space['db-0'], 3.0)
+        self.assertEqual(free_space['db-1199'], 7.0)
+        self.assertIsNone(free_space['db-600'])
+
+    def test_get_prometheus_metrics(self):
+        cw_client = paged_metric_data({'a': [3.0]})
+
+        writer = rds_disk_space.get_prometheus_metrics(
+            {'a': 20000000000.0, 'new': 20000000000.0}, cw_client=cw_client)
+
+        self.assertEqual(writer.getvalue().decode(), (
+            '# HELP aws_rds_disk_allocated Allocated storage of the RDS instance in bytes\n'
+            '# TYPE aws_rds_disk_allocated gauge\n'
+            'aws_rds_disk_allocated{instance="a"} 20000000000.0\n'
+            'aws_rds_disk_allocated{instance="new"} 20000000000.0\n'
+            '# HELP aws_rds_disk_free Free storage space of the RDS instance in bytes\n'
+            '# TYPE aws_rds_disk_free gauge\n'
+            'aws_rds_disk_free{instance="a"} 3.0\n'
+            '# HELP aws_rds_disk_free_fetch_errors RDS instances whose free storage space could not be fetched\n'
+            '# TYPE aws_rds_disk_free_fetch_errors gauge\n'
+            'aws_rds_disk_free_fetch_errors 0.0\n'
+        ))
+
+    def test_seconds_to_full_from_history(self):
+        # Losing 1000 bytes a minute with 100000 left, the newest value first
+        filling = [100000.0 + 1000.0 * age for age in range(60)]
+        cw_client = paged_metric_data({'filling': filling, 'steady': [5.0] * 60, 'new': [5.0]})
+
+        writer = rds_disk_space.get_prometheus_metrics(
+            {'filling': 1.0, 'steady': 1.0, 'new': 1.0}, cw_client=cw_client)
+
+        body = writer.getvalue().decode()
+        self.assertIn('aws_rds_disk_free{instance="filling"} 100000.0\n', body)
+        self.assertIn('aws_rds_disk_seconds_to_full{instance="filling"} 6000.0\n', body)
+        self.assertIn('aws_rds_disk_seconds_to_full{instance="steady"} +Inf\n', body)
+        self.assertNotIn('aws_rds_disk_seconds_to_full{instance="new"}', body)
+
+    @patch.dict('os.environ', {'RDS_FORECAST_WINDOW': '0'})
+    def test_forecast_can_be_turned_off(self):
+        cw_client = paged_metric_data({'filling': [100000.0 + 1000.0 * age for age in range(60)]})
+
+        body = rds_disk_space.get_prometheus_metrics({'filling': 1.0}, cw_client=cw_client).getvalue().decode()
+
+        self.assertNotIn('aws_rds_disk_seconds_to_full', body)
+        # Only the last 5 minutes count towards the current free space
+        self.assertIn('aws_rds_disk_free{instance="filling"} 100000.0\n', body)
+
+    @patch.dict('os.environ', {'RDS_FREE_SPACE_API': 'get_metric_statistics'})
+    def test_get_prometheus_metrics_per_instance(self):
+        def get_metric_statistics(Dimensions, **kwargs):
+            db_instance = Dimensions[0]['Value']
+            if db_instance == 'broken':
+                raise ClientError({'Error': {'Code': 'AccessDenied'}}, 'GetMetricStatistics')
+            if db_instance == 'new':
+                return {'Datapoints': []}
+            return {'Datapoints': [{'Average': 5.0}, {'Average': 4.0}]}
+
+        cw_client = MagicMock()
+        cw_client.get_metric_statistics.side_effect = get_metric_statistics
+
+        writer = rds_disk_space.get_prometheus_metrics(
+            {'a': 1.0, 'new': 1.0, 'broken': 1.0}, cw_client=cw_client)
+
+        body = writer.getvalue().decode()
+        self.assertIn('aws_rds_disk_free{instance="a"} 4.0\n', body)
+        self.assertNotIn('aws_rds_disk_free{instance="new"}', body)
+        self.assertNotIn('aws_rds_disk_free{instance="broken"}', body)
+        self.assertIn('aws_rds_disk_free_fetch_errors 1.0\n', body)
+
+    @patch('rds_disk_space.fetch_free_space', return_value=({'db': 2.0}, {}, {}))
+    @patch('rds_disk_space.db_to_storage_map')
+    def test_collect_targets_isolates_failures(self, db_to_storage_map, fetch_free_space):
+        com, gov = Target('com', 'us-east-1'), Target('gov', 'us-gov-west-1')
+
+        def list_instances(target):
+            if target == gov:
+                raise ClientError({'Error': {'Code': 'AccessDenied'}}, 'DescribeDBInstances')
+            return {'db': 5.0}
+
+        db_to_storage_map.side_effect = list_instances
+        storages, failures = rds_disk_space.collect_targets([com, gov])
+        body = rds_disk_space.render_metrics(storages, failures).getvalue().decode()
+
+        self.assertEqual(list(failures), [gov])
+        self.assertIn('aws_rds_disk_free{instance="db",account="com",region="us-east-1"} 2.0\n', body)
+        self.assertIn('aws_rds_target_up{account="com",region="us-east-1"} 1.0\n', body)
+        self.assertIn('aws_rds_target_up{account="gov",region="us-gov-west-1"} 0.0\n', body)
+
+    def test_failed_targets_keep_their_group(self):
+        com, gov = Target('com', 'us-east-1'), Target('gov', 'us-gov-west-1')
+        storages = {com: rds_disk_space.TargetStorage({'db': 5.0}, {'db': 2.0}, {})}
+        sink = MagicMock()
+        sink.name = 'pushgateway'
+        ledger = PushLedger()
+
+        rds_disk_space.push_targets(sink, ledger, [com, gov], storages, {gov: RuntimeError()})
+
+        sent = {call.args[0]: call.args[1].decode() for call in sink.send.call_args_list}
+        self.assertEqual(set(sent), {rds_disk_space.target_group(com), rds_disk_space.TARGETS_GROUP})
+        self.assertEqual(rds_disk_space.target_group(com),
+                         '/metrics/job/aws_rds_storage_check/account/com/region/us-east-1')
+        self.assertIn('aws_rds_disk_free{instance="db",account="com",region="us-east-1"} 2.0\n',
+                      sent[rds_disk_space.target_group(com)])
+        self.assertIn('aws_rds_target_up{account="gov",region="us-gov-west-1"} 0.0\n',
+                      sent[rds_disk_space.TARGETS_GROUP])
+        # The failed target's group is current, so it's never deleted
+        sink.delete.assert_not_called()
+        self.assertEqual(rds_disk_space.target_group(DEFAULT_TARGET), '/metrics/job/aws_rds_storage_check')
+
+    @patch.dict('os.environ', {'RDS_INVENTORY_CACHE': '/cache/inventory.json'})
+    def test_each_target_has_its_own_inventory_cache(self):
+        self.assertEqual(rds_disk_space.inventory_cache_path(), '/cache/inventory.json')
+        self.assertEqual(
+            rds_disk_space.inventory_cache_path(Target('gov', 'us-gov-west-1')),
+            '/cache/inventory-gov-us-gov-west-1.json',
+        )
+
+    def test_load_targets(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.yml') as f:
+            f.write(
+                '- account: com\n'
+                '  region: us-east-1\n'
+                '- account: gov\n'
+                '  region: us-gov-west-1\n'
+                '  aws_access_key_id_env: GOV_KEY\n'
+                '  aws_secret_access_key_env: GOV_SECRET\n'
+            )
+            f.flush()
+            targets = load_targets(f.name)
+
+        self.assertEqual(targets[0], Target('com', 'us-east-1'))
+        with patch.dict('os.environ', {'GOV_KEY': 'id', 'GOV_SECRET': 'secret'}):
+            self.assertEqual(targets[1].session_args(), {
+                'region_name': 'us-gov-west-1', 'aws_access_key_id': 'id', 'aws_secret_access_key': 'secret',
+            })
+        self.assertEqual(load_targets(None), [DEFAULT_TARGET])
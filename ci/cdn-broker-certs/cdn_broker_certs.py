@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+"""
+Report the days until the certificate of every CloudFront alias expires. Replaces
+cdn-broker-certs.sh, which ran openssl once per alias, one at a time.
+"""
+import asyncio
+import logging
+import os
+import ssl
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+import boto3
+from cryptography import x509
+
+# Modules shared with the other collectors live in ci/common
+sys.path.append(str(Path(__file__).resolve().parent.parent / "common"))
+
+from atomic_file import load_json, save_json
+from exposition import ExpositionWriter
+from job_logging import configure_logging
+from pushgateway import group_path
+from sinks import sink_from_env
+
+log = logging.getLogger("cdn_broker_certs")
+
+# Certificates this close to expiring are checked every run, cache or not
+RECHECK_DAYS = 30
+
+
+class Alias(NamedTuple):
+    """
+    An alternate domain name of a CloudFront distribution, with the id of the
+    certificate the distribution is configured to serve for it
+    """
+    id: str
+    arn: str
+    alias: str
+    domain: str
+    certificate: str
+
+    def labels(self) -> dict:
+        return {"id": self.id, "arn": self.arn, "alias": self.alias, "domain": self.domain}
+
+
+def list_aliases(cloudfront) -> list[Alias]:
+    aliases = []
+    for page in cloudfront.get_paginator("list_distributions").paginate():
+        for distribution in page["DistributionList"].get("Items", []):
+            viewer_certificate = distribution.get("ViewerCertificate", {})
+            certificate = viewer_certificate.get("Certificate") or viewer_certificate.get("IAMCertificateId", "")
+            for alias in distribution.get("Aliases", {}).get("Items", []):
+                aliases.append(Alias(
+                    distribution["Id"], distribution["ARN"], alias, distribution["DomainName"], certificate
+                ))
+    return aliases
+
+
+async def fetch_not_after(host: str, server_name: str, port: int = 443, timeout: float = 10.0) -> datetime:
+    """
+    Do a TLS handshake with host, asking for server_name with SNI, and return when the
+    certificate it serves expires. Like openssl s_client the certificate isn't
+    verified, so expired and mismatched certificates are still reported.
+    """
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    _, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port, ssl=context, server_hostname=server_name), timeout
+    )
+    try:
+        der = writer.get_extra_info("ssl_object").getpeercert(binary_form=True)
+    finally:
+        writer.close()
+        try:
+            await asyncio.wait_for(writer.wait_closed(), timeout)
+        except (OSError, asyncio.TimeoutError):
+            pass
+    return x509.load_der_x509_certificate(der).not_valid_after_utc
+
+
+async def probe_all(
+    endpoints: list[tuple[str, str]], concurrency: int, timeout: float, port: int = 443
+) -> tuple[dict, dict]:
+    """
+    Fetch the certificate expiry of every (host, server_name) with at most concurrency
+    handshakes at a time. Returns the map of endpoint -> expiry and the map of
+    endpoint -> error for the ones that failed.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(host: str, server_name: str) -> datetime:
+        async with semaphore:
+            return await fetch_not_after(host, server_name, port, timeout)
+
+    outcomes = await asyncio.gather(
+        *(probe(host, server_name) for host, server_name in endpoints), return_exceptions=True
+    )
+    expiries, errors = {}, {}
+    for endpoint, outcome in zip(endpoints, outcomes):
+        if isinstance(outcome, Exception):
+            errors[endpoint] = outcome
+        else:
+            expiries[endpoint] = outcome
+    return expiries, errors
+
+
+class ExpiryCache:
+    """
+    On-disk cache of certificate expiries by alias. A cached expiry is used instead of a
+    handshake while the distribution still has the same certificate, it was checked
+    less than ttl seconds ago and the certificate isn't within RECHECK_DAYS of expiring.
+    Without a path the cache only lasts for the run.
+    """
+
+    def __init__(self, path: str | None = None, ttl: float = 86400):
+        self.path = path
+        self.ttl = ttl
+        self.entries = self.load()
+
+    def load(self) -> dict:
+        if not self.path:
+            return {}
+        return load_json(self.path, {})
+
+    def save(self):
+        if self.path:
+            save_json(self.path, self.entries)
+
+    @staticmethod
+    def key(alias: Alias) -> str:
+        return alias.domain + " " + alias.alias
+
+    def get(self, alias: Alias, now: float) -> float | None:
+        entry = self.entries.get(self.key(alias))
+        if (
+            entry is None
+            or entry["certificate"] != alias.certificate
+            or now - entry["checked_at"] >= self.ttl
+            or entry["not_after"] - now < RECHECK_DAYS * 86400
+        ):
+            return None
+        return entry["not_after"]
+
+    def put(self, alias: Alias, not_after: float, now: float):
+        self.entries[self.key(alias)] = {
+            "certificate": alias.certificate, "not_after": not_after, "checked_at": now
+        }
+
+    def prune(self, aliases: list[Alias]):
+        # Forget aliases that no longer exist
+        current = {self.key(alias) for alias in aliases}
+        self.entries = {key: entry for key, entry in self.entries.items() if key in current}
+
+
+def days_to_expiration(not_after: float, now: float) -> int:
+    # Whole days, rounded towards zero like the shell arithmetic this replaces
+    return int((not_after - now) / 86400)
+
+
+def collect(
+    aliases: list[Alias], cache: ExpiryCache, concurrency: int, timeout: float,
+    port: int = 443, now: float | None = None,
+) -> tuple[dict, dict]:
+    """
+    Returns the map of Alias -> epoch seconds its certificate expires at, and the map of
+    Alias -> error for the aliases whose certificate couldn't be fetched
+    """
+    now = time.time() if now is None else now
+    not_afters = {}
+    to_probe = []
+    for alias in aliases:
+        cached = cache.get(alias, now)
+        if cached is None:
+            to_probe.append(alias)
+        else:
+            not_afters[alias] = cached
+    log.info("%d aliases, %d from the cache, probing %d", len(aliases), len(not_afters), len(to_probe))
+
+    endpoints = list(dict.fromkeys((alias.domain, alias.alias) for alias in to_probe))
+    expiries, probe_errors = asyncio.run(probe_all(endpoints, concurrency, timeout, port))
+    errors = {}
+    for alias in to_probe:
+        endpoint = (alias.domain, alias.alias)
+        if endpoint in expiries:
+            not_afters[alias] = expiries[endpoint].timestamp()
+            cache.put(alias, not_afters[alias], now)
+        else:
+            errors[alias] = probe_errors[endpoint]
+            log.warning("could not get the certificate of %s from %s: %r", alias.alias, alias.domain, errors[alias])
+    cache.prune(aliases)
+    return not_afters, errors
+
+
+def render_metrics(aliases: list[Alias], not_afters: dict, errors: dict, now: float) -> ExpositionWriter:
+    writer = ExpositionWriter()
+    writer.write_family("cdn_instance_count", "CloudFront distributions with aliases", "gauge",
+                        [({}, len({alias.id for alias in aliases}))])
+    writer.write_family("cdn_alias_count", "Aliases of CloudFront distributions", "gauge",
+                        [({}, len(aliases))])
+    writer.write_family(
+        "cdn_certificate_expiration", "Days until the certificate served for the alias expires", "gauge",
+        ((alias.labels(), days_to_expiration(not_after, now)) for alias, not_after in not_afters.items()),
+    )
+    writer.write_family("cdn_certificate_probe_errors", "Aliases whose certificate could not be fetched", "gauge",
+                        [({}, len(errors))])
+    return writer
+
+
+def main():
+    configure_logging(json_output=os.getenv("LOG_FORMAT", "text") == "json")
+    try:
+        sink = sink_from_env()
+    except ValueError as err:
+        log.error("%s", err)
+        sys.exit(1)
+
+    now = time.time()
+    aliases = list_aliases(boto3.client("cloudfront"))
+    cache = ExpiryCache(os.getenv("CDN_CERT_CACHE"), ttl=float(os.getenv("CDN_CERT_CACHE_TTL", "86400")))
+    not_afters, errors = collect(
+        aliases,
+        cache,
+        concurrency=int(os.getenv("CDN_PROBE_CONCURRENCY", "50")),
+        timeout=float(os.getenv("CDN_PROBE_TIMEOUT", "10")),
+        now=now,
+    )
+    output = render_metrics(aliases, not_afters, errors, now)
+
+    # The pushgateway group is shared with domain-broker-certs.sh, so keep its metrics
+    group = group_path("domain_broker", {"instance": os.getenv("ENVIRONMENT", "")})
+    sink.send(group, output.getvalue(), output.headers(), replace=False)
+    cache.save()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# The entry scripts put ci/common on the path, tests importing the helper modules
+# directly need it too
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
@@ -0,0 +1,167 @@
+import asyncio
+import datetime
+import os
+import ssl
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+import cdn_broker_certs
+from cdn_broker_certs import Alias, ExpiryCache
+
+NOW = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def server_context(directory, name, not_after):
+    # A TLS server context with a self-signed certificate for name
+    key = ec.generate_private_key(ec.SECP256R1())
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)])
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(NOW - datetime.timedelta(days=30))
+        .not_valid_after(not_after)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, name + '.crt')
+    key_path = os.path.join(directory, name + '.key')
+    with open(cert_path, 'wb') as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+class TLSServer:
+    """
+    A local TLS server on its own thread that picks the certificate by SNI, like
+    CloudFront does for the aliases of a distribution
+    """
+
+    def __init__(self, expiries):
+        self.directory = tempfile.TemporaryDirectory()
+        self.contexts = {
+            name: server_context(self.directory.name, name, not_after) for name, not_after in expiries.items()
+        }
+        default = next(iter(self.contexts.values()))
+        default.sni_callback = self.select
+        self.handshakes = 0
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        async def start():
+            self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0, ssl=default)
+            self.port = self.server.sockets[0].getsockname()[1]
+            started.set()
+
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(start(), self.loop)
+        started.wait(5)
+
+    def select(self, ssl_object, server_name, context):
+        self.handshakes += 1
+        if server_name in self.contexts:
+            ssl_object.context = self.contexts[server_name]
+
+    async def handle(self, reader, writer):
+        writer.close()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.directory.cleanup()
+
+
+class TestCdnBrokerCerts(TestCase):
+    def setUp(self):
+        self.expiries = {
+            'a.example.com': NOW + datetime.timedelta(days=90),
+            'b.example.com': NOW + datetime.timedelta(days=10),
+        }
+        self.server = TLSServer(self.expiries)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_probe_uses_sni(self):
+        endpoints = [('127.0.0.1', 'a.example.com'), ('127.0.0.1', 'b.example.com')]
+        expiries, errors = asyncio.run(
+            cdn_broker_certs.probe_all(endpoints, concurrency=2, timeout=5, port=self.server.port))
+
+        self.assertEqual(errors, {})
+        self.assertEqual(expiries[endpoints[0]], self.expiries['a.example.com'])
+        self.assertEqual(expiries[endpoints[1]], self.expiries['b.example.com'])
+
+    def test_probe_errors_are_kept_apart(self):
+        endpoints = [('127.0.0.1', 'a.example.com')]
+        expiries, errors = asyncio.run(cdn_broker_certs.probe_all(endpoints, concurrency=1, timeout=5, port=1))
+
+        self.assertEqual(expiries, {})
+        self.assertIsInstance(errors[endpoints[0]], OSError)
+
+    def test_cached_certificates_are_not_probed_again(self):
+        aliases = [
+            Alias('E1', 'arn:e1', 'a.example.com', '127.0.0.1', 'cert-a'),
+            Alias('E2', 'arn:e2', 'b.example.com', '127.0.0.1', 'cert-b'),
+        ]
+        cache = ExpiryCache()
+        now = NOW.timestamp()
+
+        not_afters, errors = cdn_broker_certs.collect(aliases, cache, 10, 5, port=self.server.port, now=now)
+        self.assertEqual(errors, {})
+        self.assertEqual(self.server.handshakes, 2)
+
+        # a is far from expiring so it comes from the cache, b is close so it's checked again
+        not_afters, errors = cdn_broker_certs.collect(aliases, cache, 10, 5, port=self.server.port, now=now + 60)
+        self.assertEqual(self.server.handshakes, 3)
+        self.assertEqual(not_afters[aliases[0]], self.expiries['a.example.com'].timestamp())
+
+        # A new certificate on the distribution is always checked
+        renewed = [aliases[0]._replace(certificate='cert-a2')]
+        cdn_broker_certs.collect(renewed, cache, 10, 5, port=self.server.port, now=now + 120)
+        self.assertEqual(self.server.handshakes, 4)
+
+    def test_render_metrics(self):
+        alias = Alias('E1', 'arn:e1', 'a.example.com', 'd1.cloudfront.net', 'cert-a')
+        other = Alias('E1', 'arn:e1', 'www.a.example.com', 'd1.cloudfront.net', 'cert-a')
+        now = NOW.timestamp()
+        not_afters = {alias: now + 24.5 * 86400}
+
+        body = cdn_broker_certs.render_metrics(
+            [alias, other], not_afters, {other: OSError()}, now).getvalue().decode()
+
+        self.assertIn('cdn_instance_count 1.0\n', body)
+        self.assertIn('cdn_alias_count 2.0\n', body)
+        self.assertIn(
+            'cdn_certificate_expiration{id="E1",arn="arn:e1",alias="a.example.com",domain="d1.cloudfront.net"} 24.0\n',
+            body)
+        self.assertIn('cdn_certificate_probe_errors 1.0\n', body)
+        self.assertEqual(cdn_broker_certs.days_to_expiration(now - 1.5 * 86400, now), -1)
+
+    def test_list_aliases(self):
+        cloudfront = MagicMock()
+        cloudfront.get_paginator.return_value.paginate.return_value = [{'DistributionList': {'Items': [
+            {'Id': 'E1', 'ARN': 'arn:e1', 'DomainName': 'd1.cloudfront.net',
+             'Aliases': {'Quantity': 2, 'Items': ['a.example.com', 'www.a.example.com']},
+             'ViewerCertificate': {'IAMCertificateId': 'cert-a', 'Certificate': 'cert-a'}},
+            {'Id': 'E2', 'ARN': 'arn:e2', 'DomainName': 'd2.cloudfront.net', 'Aliases': {'Quantity': 0}},
+        ]}}]
+
+        aliases = cdn_broker_certs.list_aliases(cloudfront)
+
+        self.assertEqual([alias.alias for alias in aliases], ['a.example.com', 'www.a.example.com'])
+        self.assertEqual(aliases[0].certificate, 'cert-a')
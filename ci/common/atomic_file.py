@@ -0,0 +1,43 @@
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path, mode='w', permissions=None):
+    """
+    Yield a temporary file next to path to write to, and rename it over path once the
+    block finishes, so a reader or a crash never leaves half a file. If the block
+    raises, the temporary file is removed and path is left as it was.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # The .tmp suffix keeps readers that match on extension, like node_exporter, away
+    f = tempfile.NamedTemporaryFile(mode, dir=directory, suffix='.tmp', delete=False)
+    try:
+        with f:
+            yield f
+        if permissions is not None:
+            os.chmod(f.name, permissions)
+        os.replace(f.name, path)
+    except BaseException:
+        try:
+            os.remove(f.name)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def load_json(path, default=None):
+    # A missing or unreadable file is the same as no file, the caller starts over
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(path, value):
+    with atomic_write(path) as f:
+        json.dump(value, f)
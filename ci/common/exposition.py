@@ -0,0 +1,80 @@
+import gzip
+import hashlib
+import io
+import math
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def format_value(value):
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+class ExpositionWriter:
+    """
+    Writes metrics in the Prometheus text exposition format, one line at a time, into
+    an in-memory buffer. Each metric family is written as a whole with its HELP and
+    TYPE lines, as the format requires. The body can optionally be gzipped as it is
+    written.
+    """
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, compress=False):
+        self.compress = compress
+        # Uncompressed size of everything written so far
+        self.bytes_written = 0
+        # Digest of the uncompressed body, gzip output differs from run to run
+        self._digest = hashlib.sha256()
+        self._buffer = io.BytesIO()
+        self._stream = gzip.GzipFile(fileobj=self._buffer, mode='wb') if compress else self._buffer
+
+    def write_family(self, name, help_text, metric_type, samples):
+        # samples is an iterable of (labels dict, value) pairs
+        self._write('# HELP ' + name + ' ' + escape_help(help_text) + '\n')
+        self._write('# TYPE ' + name + ' ' + metric_type + '\n')
+        for labels, value in samples:
+            self.write_sample(name, labels, value)
+
+    def write_sample(self, name, labels, value):
+        # An empty label value is the same as no label to Prometheus, so those are left out
+        label_text = ','.join(
+            key + '="' + escape_label_value(label_value) + '"'
+            for key, label_value in labels.items() if label_value != ''
+        )
+        if label_text:
+            self._write(name + '{' + label_text + '} ' + format_value(value) + '\n')
+        else:
+            self._write(name + ' ' + format_value(value) + '\n')
+
+    def headers(self):
+        headers = {'Content-Type': self.content_type}
+        if self.compress:
+            headers['Content-Encoding'] = 'gzip'
+        return headers
+
+    def digest(self):
+        return self._digest.hexdigest()
+
+    def getvalue(self):
+        # Finishes the body, nothing more can be written afterwards
+        if self.compress and not self._stream.closed:
+            self._stream.close()
+        return self._buffer.getvalue()
+
+    def _write(self, line):
+        encoded = line.encode('utf-8')
+        self.bytes_written += len(encoded)
+        self._digest.update(encoded)
+        self._stream.write(encoded)
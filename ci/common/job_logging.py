@@ -0,0 +1,76 @@
+import json
+import logging
+import sys
+import threading
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has, anything else on a record came in through extra=
+_RECORD_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as one JSON object per line, with the fields passed in
+    through extra= alongside the message, e.g.
+    {"time": "...", "level": "INFO", "logger": "find_stale_keys", "message": "...", "account": "..."}
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(
+            (key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES
+        )
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps debug output from a hot loop down to a readable size: the first burst
+    DEBUG records from each line of code get through, then one in every `every`.
+    Records at INFO and above are never dropped.
+    """
+
+    def __init__(self, burst=20, every=1000):
+        super().__init__()
+        self.burst = burst
+        self.every = every
+        self.seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        site = (record.pathname, record.lineno)
+        with self._lock:
+            count = self.seen.get(site, 0) + 1
+            self.seen[site] = count
+        return count <= self.burst or (count - self.burst) % self.every == 0
+
+
+def configure_logging(debug=False, json_output=False, stream=None, burst=20, every=1000, debug_loggers=()):
+    """
+    Send log records to stream (stderr by default) at INFO, as text or as JSON lines.
+    With debug set, the loggers named in debug_loggers log at DEBUG as well. The root
+    logger stays at INFO, so libraries such as botocore, which log whole response
+    bodies at DEBUG, stay quiet. Debug records are sampled with SamplingFilter.
+    Returns the handler so callers can remove it again.
+    """
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if json_output:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    handler.addFilter(SamplingFilter(burst=burst, every=every))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    for name in debug_loggers:
+        logging.getLogger(name).setLevel(logging.DEBUG if debug else logging.NOTSET)
+    return handler
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from exposition import ExpositionWriter
+from pushgateway import group_path
+
+
+class JobMetrics:
+    """
+    Records how a job performs: how long each stage takes, how many AWS API calls it
+    makes and how long they take, how many of them were retried, and how many bytes
+    it sends. All metric names are prefixed with the job name, e.g.
+    find_stale_keys_job_duration_seconds. Safe to use from several threads.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.started = time.monotonic()
+        self.stage_seconds = defaultdict(float)
+        self.api_calls = Counter()
+        self.api_seconds = defaultdict(float)
+        self.api_errors = Counter()
+        self.retries = Counter()
+        self.payload_bytes = Counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        # Stages that run more than once, e.g. once per account, add up
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.monotonic() - started)
+
+    def timed(self, iterable, name):
+        # Yields from iterable, adding the time spent producing each item to the stage
+        iterator = iter(iterable)
+        while True:
+            started = time.monotonic()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_stage(name, time.monotonic() - started)
+                return
+            self.add_stage(name, time.monotonic() - started)
+            yield item
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stage_seconds[name] += seconds
+
+    def record_api_call(self, operation, seconds, error=False, retries=0):
+        with self._lock:
+            self.api_calls[operation] += 1
+            self.api_seconds[operation] += seconds
+            if error:
+                self.api_errors[operation] += 1
+            if retries:
+                self.retries[operation] += retries
+
+    def record_retry(self, operation, count=1):
+        with self._lock:
+            self.retries[operation] += count
+
+    def record_payload(self, destination, size):
+        with self._lock:
+            self.payload_bytes[destination] += size
+
+    def instrument(self, client):
+        """
+        Count and time every call a boto3/botocore client makes, including the
+        retries botocore does on its own
+        """
+        events = client.meta.events
+
+        # Event names look like after-call.iam.GetCredentialReport
+        def before_call(context, **kwargs):
+            context['job_metrics_started'] = time.monotonic()
+
+        # Error responses from AWS come through after-call, after-call-error is for
+        # calls that never got a response
+        def after_call(event_name, parsed, context, **kwargs):
+            retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            self.record_api_call(
+                event_name.rsplit('.', 1)[-1], self._elapsed(context), error='Error' in parsed, retries=retries)
+
+        def after_call_error(event_name, context, **kwargs):
+            self.record_api_call(event_name.rsplit('.', 1)[-1], self._elapsed(context), error=True)
+
+        events.register('before-call.*.*', before_call, unique_id='job-metrics-before-call')
+        events.register('after-call.*.*', after_call, unique_id='job-metrics-after-call')
+        events.register('after-call-error.*.*', after_call_error, unique_id='job-metrics-after-call-error')
+        return client
+
+    @staticmethod
+    def _elapsed(context):
+        return time.monotonic() - context.get('job_metrics_started', time.monotonic())
+
+    def write(self, writer):
+        prefix = self.job + '_'
+        with self._lock:
+            families = [
+                ('job_duration_seconds', 'Seconds the job has been running', 'gauge',
+                    [({}, time.monotonic() - self.started)]),
+                ('job_last_run_timestamp_seconds', 'Unix time the job last reported its metrics', 'gauge',
+                    [({}, time.time())]),
+                ('stage_duration_seconds', 'Seconds spent in each stage of the job', 'gauge',
+                    [({'stage': stage}, seconds) for stage, seconds in self.stage_seconds.items()]),
+                ('aws_api_calls', 'AWS API calls made by the job', 'gauge',
+                    [({'operation': operation}, count) for operation, count in self.api_calls.items()]),
+                ('aws_api_call_seconds', 'Seconds spent waiting on AWS API calls', 'gauge',
+                    [({'operation': operation}, seconds) for operation, seconds in self.api_seconds.items()]),
+                ('aws_api_errors', 'AWS API calls that failed', 'gauge',
+                    [({'operation': operation}, count) for operation, count in self.api_errors.items()]),
+                ('retries', 'Calls that were retried', 'gauge',
+                    [({'operation': operation}, count) for operation, count in self.retries.items()]),
+                ('payload_bytes', 'Bytes of metrics sent by the job', 'gauge',
+                    [({'destination': destination}, size) for destination, size in self.payload_bytes.items()]),
+            ]
+        for name, help_text, metric_type, samples in families:
+            writer.write_family(prefix + name, help_text, metric_type, samples)
+
+    def group(self, grouping_key=None):
+        # The metrics get their own group, so they don't replace the job's regular data
+        return group_path(self.job, {'instance': 'job_metrics', **(grouping_key or {})})
+
+    def send(self, sink, grouping_key=None):
+        writer = ExpositionWriter()
+        self.write(writer)
+        sink.send(self.group(grouping_key), writer.getvalue(), writer.headers())
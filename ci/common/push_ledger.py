@@ -0,0 +1,82 @@
+import hashlib
+import threading
+import time
+
+from atomic_file import load_json, save_json
+from pushgateway import group_path
+
+
+def payload_digest(payload):
+    return hashlib.sha256(payload).hexdigest()
+
+
+class PushLedger:
+    """
+    Remembers a digest of what was last sent to each group, so groups whose metrics
+    haven't changed aren't sent again and groups that are no longer produced can be
+    deleted. Every reconcile_interval seconds a run sends every group regardless and
+    asks the sink itself for groups the ledger doesn't know about. Without a path the
+    ledger only lasts for the run. destination is the sink's destination, a ledger
+    kept for another sink is started over. Safe to use from several threads.
+    """
+
+    def __init__(self, path=None, reconcile_interval=86400, now=None, destination=None):
+        self.path = path
+        self.now = time.time() if now is None else now
+        self.destination = destination
+        ledger = self.load()
+        # Nothing recorded for another sink has been sent to this one
+        if ledger.get('destination') != destination:
+            ledger = {}
+        self.groups = ledger.get('groups', {})
+        # A new or lost ledger starts with a reconcile
+        self.reconciled_at = ledger.get('reconciled_at')
+        self.reconciling = self.reconciled_at is None or self.now - self.reconciled_at >= reconcile_interval
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not self.path:
+            return {}
+        return load_json(self.path, {})
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            ledger = {
+                'destination': self.destination,
+                'reconciled_at': self.now if self.reconciling else self.reconciled_at,
+                'groups': dict(self.groups),
+            }
+        save_json(self.path, ledger)
+
+    def needs_push(self, group, digest):
+        with self._lock:
+            return self.reconciling or self.groups.get(group) != digest
+
+    def record(self, group, digest):
+        with self._lock:
+            self.groups[group] = digest
+
+    def forget(self, group):
+        with self._lock:
+            self.groups.pop(group, None)
+
+    def delete_vanished(self, sink, job, current_groups):
+        """
+        Delete the groups of job that were sent before but aren't in current_groups
+        any more. While reconciling, the sink is asked for its groups as well, in case
+        some were sent without the ledger. Returns the deleted groups.
+        """
+        prefix = group_path(job)
+        with self._lock:
+            vanished = {
+                group for group in self.groups
+                if (group == prefix or group.startswith(prefix + '/')) and group not in current_groups
+            }
+        if self.reconciling:
+            vanished |= sink.groups(job) - set(current_groups)
+        for group in sorted(vanished):
+            sink.delete(group)
+            self.forget(group)
+        return sorted(vanished)
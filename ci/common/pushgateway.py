@@ -0,0 +1,78 @@
+import base64
+from urllib.parse import quote_plus, unquote_plus
+
+import requests
+
+
+def gateway_url(gateway):
+    # Like prometheus_client, a gateway given without a scheme is taken to be http
+    if '://' not in gateway:
+        return 'http://' + gateway
+    return gateway
+
+
+def _escape_grouping_label(label, value):
+    # The same escaping as prometheus_client, the pushgateway won't take an encoded /
+    # in a value so those, and empty values, are sent base64 encoded
+    if value == '':
+        return label + '@base64', '='
+    if '/' in value:
+        return label + '@base64', base64.urlsafe_b64encode(value.encode('utf-8')).decode('utf-8')
+    return label, quote_plus(value)
+
+
+def group_path(job, grouping_key=None):
+    """
+    The pushgateway path of a group, e.g. /metrics/job/find_stale_keys/account/prod.
+    Grouping labels are sorted so the same group always gets the same path.
+    """
+    path = '/metrics/{}/{}'.format(*_escape_grouping_label('job', job))
+    for label, value in sorted((grouping_key or {}).items()):
+        path += '/{}/{}'.format(*_escape_grouping_label(str(label), str(value)))
+    return path
+
+
+def group_labels(group):
+    """
+    The grouping labels of a group path, job included, the reverse of group_path
+    """
+    parts = group[len('/metrics/'):].split('/')
+    labels = {}
+    for label, value in zip(parts[::2], parts[1::2]):
+        if label.endswith('@base64'):
+            labels[label[:-len('@base64')]] = base64.urlsafe_b64decode(value).decode('utf-8')
+        else:
+            labels[label] = unquote_plus(value)
+    return labels
+
+
+def put_group(gateway, group, data, headers=None):
+    # A PUT replaces every metric in the group
+    res = requests.put(url=gateway_url(gateway) + group, data=data, headers=headers)
+    res.raise_for_status()
+
+
+def post_group(gateway, group, data, headers=None):
+    # A POST only replaces the metrics of the same name, others in the group are kept
+    res = requests.post(url=gateway_url(gateway) + group, data=data, headers=headers)
+    res.raise_for_status()
+
+
+def delete_group(gateway, group):
+    res = requests.delete(url=gateway_url(gateway) + group)
+    res.raise_for_status()
+
+
+def list_groups(gateway, job):
+    """
+    The paths of every group the pushgateway holds for job, from its
+    /api/v1/metrics API
+    """
+    res = requests.get(url=gateway_url(gateway) + '/api/v1/metrics')
+    res.raise_for_status()
+    groups = set()
+    for group in res.json().get('data', []):
+        labels = dict(group.get('labels', {}))
+        if labels.pop('job', None) == job:
+            groups.add(group_path(job, labels))
+    return groups
@@ -0,0 +1,104 @@
+import gzip
+import os
+from urllib.parse import quote, unquote
+
+from atomic_file import atomic_write
+from pushgateway import delete_group, gateway_url, group_path, list_groups, post_group, put_group
+
+
+class PushgatewaySink:
+    """
+    Sends each group of metrics to the pushgateway at its group path
+    """
+
+    name = 'pushgateway'
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    @property
+    def destination(self):
+        return 'pushgateway ' + gateway_url(self.gateway)
+
+    def send(self, group, body, headers=None, replace=True):
+        # replace=False only replaces the metrics of the same name in the group
+        if replace:
+            put_group(self.gateway, group, body, headers)
+        else:
+            post_group(self.gateway, group, body, headers)
+
+    def delete(self, group):
+        delete_group(self.gateway, group)
+
+    def groups(self, job):
+        return list_groups(self.gateway, job)
+
+
+class TextfileSink:
+    """
+    Writes each group of metrics to its own .prom file in directory, in the text format
+    node_exporter's textfile collector reads. Files are written to a temporary file
+    and renamed, so a reader never sees half a file. Grouping labels are only in the
+    file name, the scraper sets job and instance.
+    """
+
+    name = 'textfile'
+    suffix = '.prom'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @property
+    def destination(self):
+        return 'textfile ' + os.path.abspath(self.directory)
+
+    def path(self, group):
+        # /metrics/job/find_stale_keys/account/prod -> job@find_stale_keys@account@prod.prom,
+        # anything else that isn't safe in a file name, an @ included, is url quoted
+        name = quote(group[len('/metrics/'):], safe='/').replace('/', '@')
+        return os.path.join(self.directory, name + self.suffix)
+
+    def group(self, name):
+        # The group path of a file name, the reverse of path
+        return '/metrics/' + unquote(name[:-len(self.suffix)].replace('@', '/'))
+
+    def send(self, group, body, headers=None, replace=True):
+        # The file always holds the whole group, replace only matters to the pushgateway
+        if (headers or {}).get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        with atomic_write(self.path(group), 'wb', permissions=0o644) as f:
+            f.write(body)
+
+    def delete(self, group):
+        try:
+            os.remove(self.path(group))
+        except FileNotFoundError:
+            pass
+
+    def groups(self, job):
+        job_group = group_path(job)
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return set()
+        groups = {self.group(name) for name in names if name.endswith(self.suffix)}
+        return {group for group in groups if group == job_group or group.startswith(job_group + '/')}
+
+
+def sink_from_env(environ=None):
+    """
+    The sink chosen with METRICS_SINK: pushgateway (the default) pushes to GATEWAY_HOST
+    and GATEWAY_PORT, textfile writes to METRICS_TEXTFILE_DIR. Raises ValueError when
+    the sink isn't configured.
+    """
+    environ = os.environ if environ is None else environ
+    kind = environ.get('METRICS_SINK', 'pushgateway')
+    if kind == 'textfile':
+        if not environ.get('METRICS_TEXTFILE_DIR'):
+            raise ValueError('METRICS_TEXTFILE_DIR is required for the textfile sink.')
+        return TextfileSink(environ['METRICS_TEXTFILE_DIR'])
+    if kind == 'pushgateway':
+        if not environ.get('GATEWAY_HOST'):
+            raise ValueError('GATEWAY_HOST is required.')
+        return PushgatewaySink(environ['GATEWAY_HOST'] + ':' + environ.get('GATEWAY_PORT', '9091'))
+    raise ValueError('Unknown METRICS_SINK {!r}, expected pushgateway or textfile.'.format(kind))
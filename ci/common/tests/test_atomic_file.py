@@ -0,0 +1,33 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from atomic_file import atomic_write, load_json, save_json
+
+
+class TestAtomicFile(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'state', 'ledger.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_json_round_trip(self):
+        self.assertEqual(load_json(self.path, {}), {})
+        save_json(self.path, {'groups': {'a': 'x'}})
+        self.assertEqual(load_json(self.path), {'groups': {'a': 'x'}})
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['ledger.json'])
+
+    def test_failed_write_keeps_the_old_file(self):
+        save_json(self.path, {'version': 1})
+        with self.assertRaises(TypeError):
+            save_json(self.path, {'version': object()})
+
+        self.assertEqual(load_json(self.path), {'version': 1})
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['ledger.json'])
+
+    def test_permissions(self):
+        with atomic_write(self.path, 'wb', permissions=0o644) as f:
+            f.write(b'a 1.0\n')
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o644)
@@ -0,0 +1,26 @@
+import gzip
+from unittest import TestCase
+
+from exposition import ExpositionWriter
+
+
+class TestExpositionWriter(TestCase):
+    def test_escapes_label_values(self):
+        writer = ExpositionWriter()
+        writer.write_sample('metric', {'instance': 'a"b\\c\nd'}, 1)
+        self.assertEqual(writer.getvalue(), b'metric{instance="a\\"b\\\\c\\nd"} 1.0\n')
+
+    def test_empty_label_values_are_left_out(self):
+        writer = ExpositionWriter()
+        writer.write_sample('metric', {'instance': 'a', 'account': ''}, 1)
+        writer.write_sample('metric', {'account': ''}, 2)
+        self.assertEqual(writer.getvalue(), b'metric{instance="a"} 1.0\nmetric 2.0\n')
+
+    def test_compressed_body(self):
+        writer = ExpositionWriter(compress=True)
+        writer.write_family('metric', 'help', 'gauge', [({}, float('inf'))])
+        self.assertEqual(writer.headers()['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            gzip.decompress(writer.getvalue()),
+            b'# HELP metric help\n# TYPE metric gauge\nmetric +Inf\n',
+        )
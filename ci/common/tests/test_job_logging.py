@@ -0,0 +1,53 @@
+import io
+import json
+import logging
+from unittest import TestCase
+
+from job_logging import SamplingFilter, configure_logging
+
+
+class TestJobLogging(TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.logger = logging.getLogger('test_job_logging')
+
+    def tearDown(self):
+        logging.getLogger().removeHandler(self.handler)
+        logging.getLogger().setLevel(logging.WARNING)
+        self.logger.setLevel(logging.NOTSET)
+
+    def test_json_lines_include_extra_fields(self):
+        self.handler = configure_logging(json_output=True, stream=self.stream)
+        self.logger.info('scanned %s', 'prod', extra={'account': 'prod', 'keys': 3})
+        self.logger.debug('not shown without debug')
+
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        entry = json.loads(lines[0])
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['message'], 'scanned prod')
+        self.assertEqual(entry['account'], 'prod')
+        self.assertEqual(entry['keys'], 3)
+
+    def test_debug_output_is_sampled(self):
+        self.handler = configure_logging(
+            debug=True, stream=self.stream, burst=5, every=10, debug_loggers=['test_job_logging'])
+        for number in range(100):
+            self.logger.debug('row %d', number)
+        # Libraries stay at INFO, botocore would log every response body
+        logging.getLogger('botocore.parsers').debug('Response body: ...')
+        self.logger.info('summary')
+
+        lines = self.stream.getvalue().splitlines()
+        # 5 from the burst, then one in every 10 of the other 95, then the summary
+        self.assertEqual(len(lines), 5 + 9 + 1)
+        self.assertTrue(lines[-1].endswith('summary'))
+
+    def test_sampling_counts_each_call_site(self):
+        self.handler = logging.NullHandler()
+        sampler = SamplingFilter(burst=1, every=100)
+        first = logging.LogRecord('x', logging.DEBUG, 'a.py', 1, 'first', (), None)
+        second = logging.LogRecord('x', logging.DEBUG, 'a.py', 2, 'second', (), None)
+        self.assertTrue(sampler.filter(first))
+        self.assertFalse(sampler.filter(first))
+        self.assertTrue(sampler.filter(second))
@@ -0,0 +1,56 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+import botocore.session
+from botocore.stub import Stubber
+
+from exposition import ExpositionWriter
+from job_metrics import JobMetrics
+from sinks import PushgatewaySink
+
+
+class TestJobMetrics(TestCase):
+    def setUp(self):
+        self.metrics = JobMetrics('test_job')
+
+    def body(self):
+        writer = ExpositionWriter()
+        self.metrics.write(writer)
+        return writer.getvalue().decode()
+
+    def test_stages_add_up(self):
+        self.metrics.add_stage('push', 1.5)
+        self.metrics.add_stage('push', 2.0)
+        with self.metrics.stage('load'):
+            pass
+        self.assertEqual(list(self.metrics.timed([1, 2, 3], 'parse')), [1, 2, 3])
+
+        self.assertEqual(self.metrics.stage_seconds['push'], 3.5)
+        self.assertIn('load', self.metrics.stage_seconds)
+        self.assertIn('test_job_stage_duration_seconds{stage="push"} 3.5\n', self.body())
+
+    def test_instrumented_client_calls_are_counted(self):
+        client = botocore.session.get_session().create_client(
+            'iam', region_name='us-east-1', aws_access_key_id='a', aws_secret_access_key='b')
+        self.metrics.instrument(client)
+        with Stubber(client) as stubber:
+            stubber.add_response('generate_credential_report', {'State': 'COMPLETE'})
+            stubber.add_client_error('get_credential_report', 'ReportNotPresent')
+            client.generate_credential_report()
+            with self.assertRaises(client.exceptions.ClientError):
+                client.get_credential_report()
+
+        self.assertEqual(self.metrics.api_calls['GenerateCredentialReport'], 1)
+        self.assertEqual(self.metrics.api_calls['GetCredentialReport'], 1)
+        self.assertEqual(self.metrics.api_errors['GetCredentialReport'], 1)
+        self.assertIn('test_job_aws_api_calls{operation="GenerateCredentialReport"} 1.0\n', self.body())
+
+    @patch('pushgateway.requests.put')
+    def test_push_uses_its_own_group(self, put):
+        self.metrics.record_payload('pushgateway', 100)
+
+        self.metrics.send(PushgatewaySink('http://gateway:9091'), {'account': 'com/gov'})
+
+        url = put.call_args.kwargs['url']
+        self.assertEqual(url, 'http://gateway:9091/metrics/job/test_job/account@base64/Y29tL2dvdg==/instance/job_metrics')
+        self.assertIn(b'test_job_payload_bytes{destination="pushgateway"} 100.0\n', put.call_args.kwargs['data'])
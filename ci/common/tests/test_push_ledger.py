@@ -0,0 +1,89 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from push_ledger import PushLedger, payload_digest
+from pushgateway import gateway_url, group_labels, group_path
+
+
+class TestPushLedger(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'ledger', 'find_stale_keys.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_unchanged_groups_are_skipped_until_reconcile(self):
+        group = group_path('find_stale_keys', {'account': 'prod'})
+        ledger = PushLedger(self.path, reconcile_interval=3600, now=1000)
+        # Nothing has been reconciled yet, so the first run pushes everything
+        self.assertTrue(ledger.reconciling)
+        ledger.record(group, payload_digest(b'a 1\n'))
+        ledger.save()
+
+        ledger = PushLedger(self.path, reconcile_interval=3600, now=2000)
+        self.assertFalse(ledger.reconciling)
+        self.assertFalse(ledger.needs_push(group, payload_digest(b'a 1\n')))
+        self.assertTrue(ledger.needs_push(group, payload_digest(b'a 2\n')))
+
+        ledger = PushLedger(self.path, reconcile_interval=3600, now=4600)
+        self.assertTrue(ledger.needs_push(group, payload_digest(b'a 1\n')))
+
+    def test_a_ledger_for_another_sink_is_started_over(self):
+        group = group_path('find_stale_keys', {'account': 'prod'})
+        ledger = PushLedger(self.path, reconcile_interval=3600, now=1000, destination='pushgateway http://a:9091')
+        ledger.record(group, payload_digest(b'a 1\n'))
+        ledger.save()
+
+        ledger = PushLedger(self.path, reconcile_interval=3600, now=2000, destination='pushgateway http://a:9091')
+        self.assertFalse(ledger.needs_push(group, payload_digest(b'a 1\n')))
+
+        ledger = PushLedger(self.path, reconcile_interval=3600, now=2000, destination='textfile /textfile')
+        self.assertTrue(ledger.reconciling)
+        self.assertEqual(ledger.groups, {})
+        self.assertTrue(ledger.needs_push(group, payload_digest(b'a 1\n')))
+
+    def test_vanished_groups_are_deleted(self):
+        kept = group_path('find_stale_keys', {'account': 'prod'})
+        gone = group_path('find_stale_keys', {'account': 'closed'})
+        other_job = group_path('find_stale_keys_other')
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            json.dump({'reconciled_at': 1000, 'groups': {kept: 'x', gone: 'y', other_job: 'z'}}, f)
+
+        sink = MagicMock()
+        ledger = PushLedger(self.path, reconcile_interval=3600, now=2000)
+        self.assertEqual(ledger.delete_vanished(sink, 'find_stale_keys', {kept}), [gone])
+        sink.delete.assert_called_once_with(gone)
+        sink.groups.assert_not_called()
+        self.assertEqual(set(ledger.groups), {kept, other_job})
+
+    def test_reconcile_deletes_groups_missing_from_the_ledger(self):
+        kept = group_path('find_stale_keys', {'account': 'prod'})
+        unknown = group_path('find_stale_keys', {'account': 'old'})
+        sink = MagicMock()
+        sink.groups.return_value = {kept, unknown}
+
+        ledger = PushLedger(self.path, reconcile_interval=3600, now=1000)
+        self.assertEqual(ledger.delete_vanished(sink, 'find_stale_keys', {kept}), [unknown])
+        sink.groups.assert_called_once_with('find_stale_keys')
+        ledger.save()
+        with open(self.path) as f:
+            self.assertEqual(json.load(f)['reconciled_at'], 1000)
+
+    def test_gateway_paths(self):
+        self.assertEqual(gateway_url('prometheus:9091'), 'http://prometheus:9091')
+        self.assertEqual(gateway_url('https://prometheus:9091'), 'https://prometheus:9091')
+        self.assertEqual(
+            group_path('job', {'region': 'us-east-1', 'account': 'a/b'}),
+            '/metrics/job/job/account@base64/YS9i/region/us-east-1',
+        )
+        self.assertEqual(
+            group_path('job', {'instance': '', 'user': 'a b'}),
+            '/metrics/job/job/instance@base64/=/user/a+b',
+        )
+        labels = {'account': 'a/b', 'instance': '', 'user': 'a b'}
+        self.assertEqual(group_labels(group_path('job', labels)), {'job': 'job', **labels})
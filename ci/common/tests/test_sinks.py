@@ -0,0 +1,61 @@
+import gzip
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from pushgateway import group_path
+from sinks import PushgatewaySink, TextfileSink, sink_from_env
+
+
+class TestSinks(TestCase):
+    def test_textfile_sink_writes_a_file_per_group(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sink = TextfileSink(os.path.join(directory, 'textfile'))
+            account = group_path('find_stale_keys', {'account': 'com/gov'})
+            job = group_path('find_stale_keys')
+            sink.send(account, b'a 1.0\n')
+            sink.send(job, gzip.compress(b'b 1.0\n'), {'Content-Encoding': 'gzip'})
+            sink.send(group_path('find_stale_keys_other'), b'c 1.0\n')
+
+            self.assertEqual(
+                sorted(os.listdir(sink.directory)),
+                ['job@find_stale_keys.prom', 'job@find_stale_keys@account%40base64@Y29tL2dvdg%3D%3D.prom',
+                 'job@find_stale_keys_other.prom'],
+            )
+            with open(sink.path(job), 'rb') as f:
+                self.assertEqual(f.read(), b'b 1.0\n')
+            self.assertEqual(sink.groups('find_stale_keys'), {account, job})
+
+            sink.delete(account)
+            sink.delete(account)
+            self.assertEqual(sink.groups('find_stale_keys'), {job})
+
+    @patch('pushgateway.requests')
+    def test_pushgateway_sink(self, requests):
+        sink = PushgatewaySink('gateway:9091')
+        sink.send('/metrics/job/a', b'a 1.0\n')
+        sink.send('/metrics/job/b', b'b 1.0\n', replace=False)
+        sink.delete('/metrics/job/c')
+
+        self.assertEqual(requests.put.call_args.kwargs['url'], 'http://gateway:9091/metrics/job/a')
+        self.assertEqual(requests.post.call_args.kwargs['url'], 'http://gateway:9091/metrics/job/b')
+        self.assertEqual(requests.delete.call_args.kwargs['url'], 'http://gateway:9091/metrics/job/c')
+
+    def test_sink_from_env(self):
+        self.assertEqual(sink_from_env({'GATEWAY_HOST': 'http://gateway'}).gateway, 'http://gateway:9091')
+        self.assertEqual(sink_from_env({'GATEWAY_HOST': 'gateway'}).destination, 'pushgateway http://gateway:9091')
+        self.assertEqual(
+            sink_from_env({'METRICS_SINK': 'textfile', 'METRICS_TEXTFILE_DIR': '/textfile'}).destination,
+            'textfile /textfile',
+        )
+        self.assertEqual(
+            sink_from_env({'METRICS_SINK': 'textfile', 'METRICS_TEXTFILE_DIR': '/textfile'}).directory,
+            '/textfile',
+        )
+        with self.assertRaises(ValueError):
+            sink_from_env({})
+        with self.assertRaises(ValueError):
+            sink_from_env({'METRICS_SINK': 'textfile'})
+        with self.assertRaises(ValueError):
+            sink_from_env({'METRICS_SINK': 'kafka'})